@@ -13,11 +13,21 @@ from dotenv import load_dotenv
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
+from starlette.formparsers import MultiPartParser
 
 load_dotenv()  # load .env before anything else
 
 from app.routers import next_step, plan, refine, replan  # noqa: E402
 
+# Largest request body accepted: the 20 MB screenshot cap plus room for the
+# other form fields and multipart framing.
+MAX_REQUEST_BYTES = 24 * 1024 * 1024
+
+# Starlette spools uploaded files to a temp file on disk past 1 MB. Screenshots
+# are routinely 3-10 MB and read straight back into memory, so keep uploads up
+# to the 20 MB screenshot cap in RAM and skip the disk write + re-read.
+MultiPartParser.spool_max_size = MAX_REQUEST_BYTES
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -56,6 +66,22 @@ app.add_middleware(
 )
 
 
+# ---------------------------------------------------------------------------
+# Body size limit — reject oversized uploads from the Content-Length header,
+# before the multipart body is read. Registered before the request ID
+# middleware so the rejection is still logged with its rid.
+# ---------------------------------------------------------------------------
+@app.middleware("http")
+async def body_size_limit_middleware(request: Request, call_next):
+    content_length = request.headers.get("content-length")
+    if content_length is not None and content_length.isdigit() and int(content_length) > MAX_REQUEST_BYTES:
+        return JSONResponse(
+            status_code=413,
+            content={"detail": f"Request body exceeds {MAX_REQUEST_BYTES // (1024 * 1024)} MB limit"},
+        )
+    return await call_next(request)
+
+
 # ---------------------------------------------------------------------------
 # Request ID + timing middleware
 # ---------------------------------------------------------------------------
@@ -9,14 +9,20 @@
 
 import asyncio
 import io
-import json
 import os
+import threading
 import time
+from enum import Enum
+from functools import lru_cache
 from uuid import uuid4
 
+import numpy as np
+import orjson
+from cachetools import LRUCache, TTLCache
 from fastapi import APIRouter, File, Form, HTTPException, Request, UploadFile
 from fastapi.responses import StreamingResponse
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
+from pydantic import ValidationError
 
 from app.schemas.step_plan import (
     CropRect,
@@ -27,19 +33,33 @@ from app.schemas.step_plan import (
     Step,
     StepPlan,
     TargetRect,
+    TargetRectBBox,
     TargetType,
 )
-from app.services.agent import AgentError, is_native_genai_available, upload_images_to_gemini, verify_element
-from app.services.debug import DebugSession
+from app.services.agent import (
+    AgentError,
+    _image_data_url,
+    generate_identify_element,
+    is_native_genai_available,
+    upload_images_to_gemini,
+    verify_element,
+)
+from app.services.debug import DebugSession, write_debug_file
 from app.services.mock import get_mock_plan
 from app.services.search import search_for_goal, get_stored_search_context
 from app.services.omniparser import (
+    ElementGrid,
     OmniElement,
     OmniParserResult,
+    build_element_grid,
     detect_elements,
+    detect_elements_batch,
     draw_numbered_boxes,
     format_elements_context,
+    get_label_font,
+    label_text_size,
     parse_screenshot as omniparser_parse,
+    screenshot_digest,
     snap_to_nearest_element,
 )
 
@@ -48,6 +68,43 @@ router = APIRouter()
 MAX_SCREENSHOT_BYTES = 20 * 1024 * 1024  # 20 MB
 
 
+def _decode_rgb(image_bytes: bytes) -> Image.Image:
+    """Fully decode image bytes into an RGB PIL image."""
+    return Image.open(io.BytesIO(image_bytes)).convert("RGB")
+
+
+def _encode_png(img: Image.Image) -> bytes:
+    """
+    Encode a PIL image as PNG bytes.
+    Every PNG here is transient (LLM upload, YOLO input, debug dump), so use
+    zlib level 1: several times faster than the default 6 for a few % more bytes.
+    BytesIO.getvalue() hands back the internal buffer without copying as long
+    as no memoryview is exported, so this is the cheapest way to get bytes out.
+    """
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", compress_level=1)
+    return buf.getvalue()
+
+
+def _encode_jpeg(img: Image.Image, quality: int, subsampling: int = -1) -> bytes:
+    """Encode a PIL image (RGB) as JPEG bytes. subsampling=0 keeps full chroma (crisp small text)."""
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=quality, optimize=False, subsampling=subsampling)
+    return buf.getvalue()
+
+
+def _encode_som_image(img: Image.Image, quality: int | None = None) -> bytes:
+    """
+    Encode a marker-annotated image for the LLM.
+    SOM_IMAGE_FORMAT=png keeps lossless PNG; the default (jpeg) is faster to
+    encode and ~4x smaller to upload, with 4:4:4 chroma so marker digits stay sharp.
+    quality defaults to _GEMINI_JPEG_QUALITY.
+    """
+    if os.getenv("SOM_IMAGE_FORMAT", "jpeg").lower() == "png":
+        return _encode_png(img)
+    return _encode_jpeg(img, quality or _GEMINI_JPEG_QUALITY, subsampling=0)
+
+
 # ---------------------------------------------------------------------------
 # Shared: convert Gemini step_data → (rx, ry, rw, rh) with YOLO snapping
 # ---------------------------------------------------------------------------
@@ -62,12 +119,72 @@ _ADVANCE_MAP = {
 }
 
 
+def _clamp_bbox(xy, wh, min_size: float = 0.02) -> tuple[float, float, float, float]:
+    """
+    Clamp a normalized bbox onto the screen: origin into [0, 1], size into
+    [min_size, 1 - origin]. If min_size pushes the box past the right or
+    bottom edge, the origin is shifted back so x + w and y + h stay <= 1.
+    xy / wh are (x, y) and (w, h) pairs or arrays, so both axes go through
+    the same NumPy ops.
+    """
+    xy = np.clip(xy, 0.0, 1.0)
+    wh = np.maximum(np.minimum(wh, 1.0 - xy), min_size)
+    xy = np.minimum(xy, 1.0 - wh)
+    wh = np.minimum(wh, 1.0 - xy)  # absorb float rounding in 1 - wh
+    rx, ry = xy.tolist()
+    rw, rh = wh.tolist()
+    return rx, ry, rw, rh
+
+
+def _bbox_target(
+    x: float, y: float, w: float, h: float,
+    confidence=None,
+    label=None,
+) -> TargetRect:
+    """
+    Build a bbox_norm TargetRect from already-clamped coords without running
+    Pydantic validation. confidence/label usually come straight from LLM JSON,
+    so they are coerced here (confidence to a float in [0,1] or None, label
+    to str or None) to keep the unvalidated model well-formed.
+    """
+    try:
+        confidence = min(max(float(confidence), 0.0), 1.0) if confidence is not None else None
+    except (TypeError, ValueError):
+        confidence = None
+    if confidence != confidence:  # NaN
+        confidence = None
+    return TargetRectBBox.model_construct(
+        type=TargetType.bbox_norm,
+        x=x, y=y, w=w, h=h,
+        confidence=confidence,
+        label=str(label) if label is not None else None,
+    )
+
+
+def _advance(advance_type) -> Advance:
+    """Advance for an LLM advance string (unknown values → click_in_target), unvalidated."""
+    return Advance.model_construct(type=_ADVANCE_MAP.get(advance_type, AdvanceType.click_in_target))
+
+
+class BBoxTrust(str, Enum):
+    """Which branch of _resolve_bbox produced the bbox (how much to trust it)."""
+    agree = "agree"                        # element_id and box_2d centers within 0.08
+    confirmed = "confirmed"                # box_2d snapped to the same element as element_id
+    disagree_snapped = "disagree_snapped"  # box_2d snapped to a different element
+    disagree_keep = "disagree_keep"        # disagreement, no snap — kept element_id
+    element_only = "element_only"          # element_id without box_2d
+    snap_only = "snap_only"                # box_2d only, snapped (or raw) coords
+    fallback = "fallback"                  # center-of-screen fallback
+
+
 def _resolve_bbox(
     step_data: dict,
     elements: list,
     request_id: str = "",
     endpoint: str = "plan",
-) -> tuple[float, float, float, float]:
+    grid: ElementGrid | None = None,
+    elem_map: dict[int, OmniElement] | None = None,
+) -> tuple[float, float, float, float, "BBoxTrust"]:
     """
     Resolve a bounding box from Gemini's response, using YOLO elements for precision.
 
@@ -79,14 +196,21 @@ def _resolve_bbox(
       3. box_2d only → convert from 0-1000, snap to nearest YOLO element
       4. Fallback: center of screen
 
-    Returns (x, y, w, h) in normalized [0,1] coords.
+    Pass a prebuilt grid (build_element_grid) and id -> element map when
+    resolving many steps against the same elements, so snapping skips
+    far-away elements and the id lookup isn't rebuilt per step.
+
+    Returns (x, y, w, h, trust) with the bbox in normalized [0,1] coords and
+    trust naming the branch that produced it (see BBoxTrust).
     """
-    elem_map = {e.id: e for e in elements}
+    if elem_map is None:
+        elem_map = {e.id: e for e in elements}
     step_id = step_data.get("id", "?")
     box_2d = step_data.get("box_2d")
     element_id = step_data.get("element_id")
 
     rx, ry, rw, rh = None, None, None, None
+    trust = BBoxTrust.fallback
 
     # Parse box_2d into normalized coords for use in cross-validation
     raw_x, raw_y, raw_w, raw_h = None, None, None, None
@@ -115,39 +239,45 @@ def _resolve_bbox(
             if center_dist <= 0.08:
                 # AGREE: element_id and box_2d are close — trust element_id (pixel-perfect from YOLO)
                 rx, ry, rw, rh = eid_x, eid_y, eid_w, eid_h
+                trust = BBoxTrust.agree
                 print(f"[{endpoint}] rid={request_id} step={step_id} AGREE (dist={center_dist:.3f}): using element_id={element_id}")
             else:
                 # DISAGREE: Gemini may have misread the box number.
                 # Snap box_2d to nearest YOLO element — spatial location is more reliable
                 # than a potentially misread number label.
                 snap_x, snap_y, snap_w, snap_h, snap_id = snap_to_nearest_element(
-                    raw_x, raw_y, raw_w, raw_h, elements
+                    raw_x, raw_y, raw_w, raw_h, elements, grid=grid
                 )
                 if snap_id is not None and snap_id != element_id:
                     # box_2d snapped to a DIFFERENT element — use it
                     print(f"[{endpoint}] rid={request_id} step={step_id} DISAGREE (dist={center_dist:.3f}): "
                           f"element_id={element_id} vs box_2d snap=elem[{snap_id}]. Using box_2d snap.")
                     rx, ry, rw, rh = snap_x, snap_y, snap_w, snap_h
+                    trust = BBoxTrust.disagree_snapped
                 elif snap_id == element_id:
                     # box_2d snapped to the SAME element — extra confirmation, use it
                     print(f"[{endpoint}] rid={request_id} step={step_id} CONFIRMED: "
                           f"box_2d snap also chose elem[{snap_id}]. Using YOLO bbox.")
                     rx, ry, rw, rh = snap_x, snap_y, snap_w, snap_h
+                    trust = BBoxTrust.confirmed
                 else:
                     # box_2d didn't snap to anything — trust element_id despite distance
                     print(f"[{endpoint}] rid={request_id} step={step_id} DISAGREE but no snap: "
                           f"using element_id={element_id} (no better alternative)")
                     rx, ry, rw, rh = eid_x, eid_y, eid_w, eid_h
+                    trust = BBoxTrust.disagree_keep
         else:
             # No box_2d, just use element_id directly
             rx, ry, rw, rh = eid_x, eid_y, eid_w, eid_h
+            trust = BBoxTrust.element_only
             print(f"[{endpoint}] rid={request_id} step={step_id} using element_id={element_id} (no box_2d)")
 
     # --- Priority 2: box_2d only (no valid element_id) → snap to YOLO ---
     if rx is None and raw_x is not None:
         rx, ry, rw, rh, matched_id = snap_to_nearest_element(
-            raw_x, raw_y, raw_w, raw_h, elements
+            raw_x, raw_y, raw_w, raw_h, elements, grid=grid
         )
+        trust = BBoxTrust.snap_only
         if matched_id is not None:
             print(f"[{endpoint}] rid={request_id} step={step_id} SNAPPED box_2d to elem[{matched_id}]=({rx:.3f},{ry:.3f},{rw:.3f},{rh:.3f})")
         else:
@@ -158,13 +288,9 @@ def _resolve_bbox(
         rx, ry, rw, rh = 0.4, 0.4, 0.2, 0.2
         print(f"[{endpoint}] rid={request_id} step={step_id} FALLBACK center-of-screen")
 
-    # Clamp
-    rx = max(0.0, min(rx, 1.0))
-    ry = max(0.0, min(ry, 1.0))
-    rw = max(0.02, min(rw, 1.0 - rx))
-    rh = max(0.02, min(rh, 1.0 - ry))
+    rx, ry, rw, rh = _clamp_bbox((rx, ry), (rw, rh))
 
-    return rx, ry, rw, rh
+    return rx, ry, rw, rh, trust
 
 
 # ---------------------------------------------------------------------------
@@ -174,6 +300,21 @@ def _resolve_bbox(
 _VERIFY_CROP_PAD = 0.08  # padding around target bbox for crop
 _VERIFY_MIN_CROP = 0.15  # minimum crop dimension
 _VERIFY_CONFIDENCE_THRESHOLD = 0.6  # verify steps below this confidence
+# Skip verification entirely when element_id and box_2d agree and Gemini is this sure
+_VERIFY_SKIP_CONFIDENCE = 0.8
+_TRUSTED_BBOX = {BBoxTrust.agree, BBoxTrust.confirmed}
+
+
+def _should_verify(trust: BBoxTrust | None, confidence: float | None) -> bool:
+    """
+    Decide whether a resolved step is worth a verification LLM call.
+    Low-confidence steps are always verified. Otherwise only the
+    AGREE / CONFIRMED branches with confidence >= 0.8 are skipped.
+    """
+    conf = confidence if confidence is not None else 0.0
+    if conf < _VERIFY_CONFIDENCE_THRESHOLD:
+        return True
+    return trust not in _TRUSTED_BBOX or conf < _VERIFY_SKIP_CONFIDENCE
 
 
 async def _verify_and_correct_step(
@@ -185,11 +326,14 @@ async def _verify_and_correct_step(
     original_screenshot_bytes: bytes,
     elements: list,
     request_id: str = "",
+    trust: BBoxTrust | None = None,
 ) -> tuple[float, float, float, float]:
     """
     Verify a resolved bbox by cropping, running YOLO on the crop,
     and asking the LLM to confirm the element.
 
+    If trust (from _resolve_bbox) is AGREE/CONFIRMED and the step's
+    confidence is high, returns the bbox unchanged without any LLM call.
     If the LLM says the element is wrong, returns the corrected bbox.
     Otherwise returns the original bbox.
     """
@@ -198,6 +342,11 @@ async def _verify_and_correct_step(
     label = step_data.get("label", "")
     step_id = step_data.get("id", "?")
 
+    if not _should_verify(trust, step_data.get("confidence")):
+        print(f"[verify] rid={request_id} step={step_id} skipped (trust={trust.value}, "
+              f"conf={step_data.get('confidence')})")
+        return resolved_x, resolved_y, resolved_w, resolved_h
+
     # Compute crop region around the resolved bbox
     pad = _VERIFY_CROP_PAD
     cx = max(0.0, resolved_x - pad)
@@ -215,21 +364,19 @@ async def _verify_and_correct_step(
         cy = max(0.0, center - _VERIFY_MIN_CROP / 2)
         ch = min(_VERIFY_MIN_CROP, 1.0 - cy)
 
-    # Crop the screenshot
-    img = Image.open(io.BytesIO(original_screenshot_bytes))
+    # Crop the screenshot (decode, encode and YOLO all run off the event loop)
+    img = await asyncio.to_thread(_decode_rgb, original_screenshot_bytes)
     actual_w, actual_h = img.size
     left = int(cx * actual_w)
     top = int(cy * actual_h)
     right = int((cx + cw) * actual_w)
     bottom = int((cy + ch) * actual_h)
-    cropped = img.crop((left, top, right, bottom)).convert("RGB")
+    cropped = img.crop((left, top, right, bottom))
 
-    crop_buf = io.BytesIO()
-    cropped.save(crop_buf, format="PNG")
-    raw_crop_bytes = crop_buf.getvalue()
+    raw_crop_bytes = await asyncio.to_thread(_encode_png, cropped)
 
     # Run YOLO on the crop for precise local detection
-    crop_elements = detect_elements(raw_crop_bytes)
+    crop_elements = await asyncio.to_thread(detect_elements, raw_crop_bytes)
     crop_elements.sort(key=lambda e: (e.bbox_xyxy[1], e.bbox_xyxy[0]))
     for i, e in enumerate(crop_elements):
         e.id = i
@@ -239,17 +386,12 @@ async def _verify_and_correct_step(
         return resolved_x, resolved_y, resolved_w, resolved_h
 
     # Draw numbered boxes on the crop
-    annotated_crop = draw_numbered_boxes(raw_crop_bytes, crop_elements)
+    annotated_crop = await asyncio.to_thread(draw_numbered_boxes, raw_crop_bytes, crop_elements)
     crop_ctx = format_elements_context(crop_elements)
 
     # Save debug images
-    try:
-        with open(f"/tmp/og_verify_{step_id}_crop.png", "wb") as f:
-            f.write(annotated_crop)
-        with open(f"/tmp/og_verify_{step_id}_raw.png", "wb") as f:
-            f.write(raw_crop_bytes)
-    except Exception:
-        pass
+    write_debug_file(f"/tmp/og_verify_{step_id}_crop.jpg", annotated_crop)
+    write_debug_file(f"/tmp/og_verify_{step_id}_raw.png", raw_crop_bytes)
 
     # Find which crop element corresponds to our original resolved bbox
     # Map the resolved bbox into crop-relative coordinates
@@ -341,18 +483,11 @@ async def _verify_and_correct_step(
 # ---------------------------------------------------------------------------
 # Session cache: pre-processed YOLO results keyed by session_id.
 # Populated by /start, consumed by /plan-stream.
-# Entries expire after 120s to avoid memory leaks.
+# Entries expire after 120s (evicted lazily by TTLCache) to avoid memory leaks.
 # ---------------------------------------------------------------------------
-_session_cache: dict[str, dict] = {}
 _SESSION_TTL = 120  # seconds
-
-
-def _prune_sessions():
-    """Remove expired sessions from the cache."""
-    now = time.time()
-    expired = [sid for sid, v in _session_cache.items() if now - v["ts"] > _SESSION_TTL]
-    for sid in expired:
-        del _session_cache[sid]
+_SESSION_MAX = 1024  # max cached sessions before LRU eviction
+_session_cache: TTLCache = TTLCache(maxsize=_SESSION_MAX, ttl=_SESSION_TTL)
 
 # SoM grid configuration — coarse grid for hybrid pipeline.
 # 6x4 = 24 markers — big, easy to read. LLM selects MULTIPLE markers
@@ -360,22 +495,72 @@ def _prune_sessions():
 SOM_COLUMNS = 6
 SOM_ROWS = 4
 
+
+def _grid_centers(columns: int, rows: int) -> list[tuple[int, float, float]]:
+    """Row-major (id, cx, cy) cell centers of a columns x rows grid, normalized."""
+    gx, gy = np.meshgrid((np.arange(columns) + 0.5) / columns, (np.arange(rows) + 0.5) / rows)
+    return list(zip(range(columns * rows), gx.ravel().tolist(), gy.ravel().tolist()))
+
+
+# Marker centers never change — only the radius depends on the image size
+_SOM_GRID = _grid_centers(SOM_COLUMNS, SOM_ROWS)
+# Same centers as an (N, 2) array indexed by marker id, for bbox unions
+_SOM_GRID_XY = np.array([(cx, cy) for _, cx, cy in _SOM_GRID], dtype=np.float64)
+
+
+@lru_cache(maxsize=32)
+def _marker_sprite(
+    radius: int,
+    border_width: int,
+    fill: tuple[int, int, int, int],
+    outline: tuple[int, int, int, int],
+) -> Image.Image:
+    """
+    Pre-rendered RGBA marker circle. Every marker of a given size is identical,
+    so it is rasterized once and alpha-pasted per marker instead of re-drawn.
+    """
+    size = 2 * radius + 1
+    tile = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    ImageDraw.Draw(tile).ellipse(
+        [0, 0, 2 * radius, 2 * radius], fill=fill, outline=outline, width=border_width,
+    )
+    return tile
+
+
 # Default half-size of the bbox drawn around a marker center (normalized).
 # For 6x4 grid: cells are 16.7% x 25%, so half-cell = 8.3% x 12.5%.
 # When multiple markers are selected, the bbox spans all of them.
 _DEFAULT_MARKER_BBOX_HALF = 0.08
 
+# Gemini downsamples large images internally (~1536-2048px effective), so
+# shipping a full-resolution Retina PNG only costs encode time and bandwidth.
+# Images sent to Gemini are capped at this size and encoded as JPEG.
+# YOLO and final bbox rendering still use the full-resolution screenshot.
+_GEMINI_MAX_DIM = 1536
+_GEMINI_JPEG_QUALITY = 90
+
+
+def _encode_for_gemini(image_bytes: bytes) -> bytes:
+    """Downscale an image to _GEMINI_MAX_DIM (long side) and encode as JPEG."""
+    img = _decode_rgb(image_bytes)
+    if max(img.size) > _GEMINI_MAX_DIM:
+        img.thumbnail((_GEMINI_MAX_DIM, _GEMINI_MAX_DIM), Image.LANCZOS)
+    return _encode_jpeg(img, _GEMINI_JPEG_QUALITY)
+
 
 def _generate_markers_and_image(
     screenshot_bytes: bytes,
 ) -> tuple[list[SoMMarker], bytes]:
     """
     Generate a grid of numbered markers and draw them directly on the
-    screenshot at its ACTUAL pixel resolution using Pillow.
+    screenshot using Pillow. The screenshot is first downscaled to
+    _GEMINI_MAX_DIM since the result is only ever sent to Gemini.
     Marker size scales with image resolution so they're always readable.
-    Returns (markers_list, marked_png_bytes).
+    Returns (markers_list, marked_jpeg_bytes).
     """
-    img = Image.open(io.BytesIO(screenshot_bytes)).convert("RGBA")
+    img = _decode_rgb(screenshot_bytes)
+    if max(img.size) > _GEMINI_MAX_DIM:
+        img.thumbnail((_GEMINI_MAX_DIM, _GEMINI_MAX_DIM), Image.LANCZOS)
     actual_w, actual_h = img.size
 
     # Scale marker size to image resolution.
@@ -388,51 +573,31 @@ def _generate_markers_and_image(
 
     print(f"[plan] image={actual_w}x{actual_h}, marker_radius={marker_radius}, font_size={font_size}")
 
-    # Generate marker positions (normalized)
-    markers: list[SoMMarker] = []
+    # Markers from the precomputed grid (positions are known-valid, skip validation)
     norm_radius = marker_radius / max(actual_w, actual_h)
+    markers: list[SoMMarker] = [
+        SoMMarker.model_construct(id=i, cx=cx, cy=cy, radius=norm_radius)
+        for i, cx, cy in _SOM_GRID
+    ]
 
-    for row in range(SOM_ROWS):
-        for col in range(SOM_COLUMNS):
-            cx = (col + 0.5) / SOM_COLUMNS
-            cy = (row + 0.5) / SOM_ROWS
-            markers.append(SoMMarker(
-                id=len(markers),
-                cx=round(cx, 6),
-                cy=round(cy, 6),
-                radius=round(norm_radius, 6),
-            ))
+    # Draw straight onto the RGB image; an RGBA draw context blends the
+    # translucent fills in place, so no full-size overlay + composite pass
+    draw = ImageDraw.Draw(img, "RGBA")
 
-    # Create a transparent overlay for the markers
-    overlay = Image.new("RGBA", img.size, (0, 0, 0, 0))
-    draw = ImageDraw.Draw(overlay)
-
-    try:
-        font = ImageFont.truetype("/System/Library/Fonts/Helvetica.ttc", font_size)
-    except Exception:
-        try:
-            font = ImageFont.truetype("/System/Library/Fonts/SFNSMono.ttf", font_size)
-        except Exception:
-            font = ImageFont.load_default()
+    font = get_label_font(font_size)
+    # White filled circle with red border
+    sprite = _marker_sprite(marker_radius, border_width, (255, 255, 255, 220), (220, 40, 40, 255))
 
     for m in markers:
         px = m.cx * actual_w
         py = m.cy * actual_h
         r = marker_radius
 
-        # White filled circle with red border
-        draw.ellipse(
-            [px - r, py - r, px + r, py + r],
-            fill=(255, 255, 255, 220),
-            outline=(220, 40, 40, 255),
-            width=border_width,
-        )
+        img.paste(sprite, (round(px - r), round(py - r)), sprite)
 
         # Marker ID text, centered in circle
         text = str(m.id)
-        bbox = draw.textbbox((0, 0), text, font=font)
-        tw = bbox[2] - bbox[0]
-        th = bbox[3] - bbox[1]
+        tw, th = label_text_size(font_size, text)
         draw.text(
             (px - tw / 2, py - th / 2),
             text,
@@ -440,13 +605,8 @@ def _generate_markers_and_image(
             font=font,
         )
 
-    # Composite overlay onto the screenshot
-    result = Image.alpha_composite(img, overlay).convert("RGB")
-
-    # Encode as PNG
-    buf = io.BytesIO()
-    result.save(buf, format="PNG")
-    marked_bytes = buf.getvalue()
+    # JPEG by default — markers are large and high-contrast, so lossy is fine
+    marked_bytes = _encode_som_image(img)
 
     print(f"[plan] drew {len(markers)} markers on {actual_w}x{actual_h} image -> {len(marked_bytes)} bytes")
     return markers, marked_bytes
@@ -461,30 +621,30 @@ def _som_plan_to_step_plan(
     All selected markers for a step are merged into a single bounding TargetRect
     that spans from the min to max marker positions.
     """
-    marker_map = {m.id: m for m in markers}
+    # Marker ids are their grid indices (0..len-1), so a range check replaces a lookup map
+    n_markers = len(markers)
     converted_steps: list[Step] = []
 
     for som_step in som_plan.steps:
-        # Collect all valid marker positions for this step
-        found_markers = []
+        # Collect all valid marker ids for this step
+        found_ids: list[int] = []
         label = None
         avg_conf = 0.0
         for st in som_step.som_targets:
-            marker = marker_map.get(st.marker_id)
-            if marker is None:
+            if not 0 <= st.marker_id < n_markers:
                 print(f"[plan] WARNING: marker_id={st.marker_id} not found in markers list, skipping")
                 continue
-            found_markers.append(marker)
+            found_ids.append(st.marker_id)
             if st.label and not label:
                 label = st.label
             if st.confidence is not None:
                 avg_conf += st.confidence
 
-        if not found_markers:
-            converted_steps.append(Step(
+        if not found_ids:
+            converted_steps.append(Step.model_construct(
                 id=som_step.id,
                 instruction=som_step.instruction,
-                targets=[TargetRect(
+                targets=[TargetRectBBox.model_construct(
                     type=TargetType.bbox_norm,
                     x=0.4, y=0.4, w=0.2, h=0.2,
                     confidence=0.1,
@@ -495,32 +655,26 @@ def _som_plan_to_step_plan(
             ))
             continue
 
-        avg_conf = avg_conf / len(found_markers) if found_markers else 0.0
+        avg_conf = avg_conf / len(found_ids)
 
-        # Compute bounding box spanning all selected markers
-        min_cx = min(m.cx for m in found_markers)
-        max_cx = max(m.cx for m in found_markers)
-        min_cy = min(m.cy for m in found_markers)
-        max_cy = max(m.cy for m in found_markers)
+        # Bounding box spanning all selected markers: gather their centers from
+        # the precomputed grid table (markers come from _SOM_GRID) and reduce once
+        pts = _SOM_GRID_XY[found_ids]
+        lo = pts.min(axis=0)
+        hi = pts.max(axis=0)
 
+        # Pad by half a marker cell, keep on screen, ensure minimum size
         pad = _DEFAULT_MARKER_BBOX_HALF
-        x = max(0.0, min_cx - pad)
-        y = max(0.0, min_cy - pad)
-        w = min(max_cx - min_cx + pad * 2, 1.0 - x)
-        h = min(max_cy - min_cy + pad * 2, 1.0 - y)
+        x, y, w, h = _clamp_bbox(lo - pad, hi - lo + pad * 2)
 
-        # Ensure minimum size
-        w = max(w, 0.02)
-        h = max(h, 0.02)
-
-        targets = [TargetRect(
+        targets = [TargetRectBBox.model_construct(
             type=TargetType.bbox_norm,
             x=x, y=y, w=w, h=h,
             confidence=avg_conf if avg_conf > 0 else None,
             label=label,
         )]
 
-        converted_steps.append(Step(
+        converted_steps.append(Step.model_construct(
             id=som_step.id,
             instruction=som_step.instruction,
             targets=targets,
@@ -528,7 +682,7 @@ def _som_plan_to_step_plan(
             safety=som_step.safety,
         ))
 
-    return StepPlan(
+    return StepPlan.model_construct(
         version=som_plan.version,
         goal=som_plan.goal,
         image_size=som_plan.image_size,
@@ -545,19 +699,35 @@ REFINE_SUB_ROWS = 10     # sub-grid rows
 REFINE_PADDING = 0.05    # padding around the coarse target region for the crop
 # Padding added around the sub-marker-defined bbox (normalized to full image)
 _REFINED_BBOX_PAD = 0.015
+# Sub-marker crops are small; q85 keeps the digits legible at a lower encode cost
+_SUB_MARKER_JPEG_QUALITY = 85
+# Row-major (id, cx, cy) sub-grid centers within the crop, computed once
+_SUB_GRID = [
+    (row * REFINE_SUB_COLS + col, (col + 0.5) / REFINE_SUB_COLS, (row + 0.5) / REFINE_SUB_ROWS)
+    for row in range(REFINE_SUB_ROWS)
+    for col in range(REFINE_SUB_COLS)
+]
+_SUB_GRID_XY = np.array([(cx, cy) for _, cx, cy in _SUB_GRID], dtype=np.float64)
 
 
 def _crop_and_draw_sub_markers(
-    original_bytes: bytes,
+    img: Image.Image,
     target_rect: TargetRect,
 ) -> tuple[CropRect, bytes, list[dict]]:
     """
     Crop a region around the coarse target (which may span multiple markers)
-    from the original screenshot, then draw a dense 12x12 numbered sub-grid
+    from the decoded screenshot, then draw a dense 12x12 numbered sub-grid
     on the crop. All drawing at actual pixel resolution.
-    Returns (crop_rect, marked_crop_png, sub_markers).
+    Returns (crop_rect, marked_crop_bytes, sub_markers).
     """
-    img = Image.open(io.BytesIO(original_bytes))
+    return _draw_sub_markers(*_crop_sub_region(img, target_rect))
+
+
+def _crop_sub_region(
+    img: Image.Image,
+    target_rect: TargetRect,
+) -> tuple[CropRect, Image.Image]:
+    """Crop the padded coarse-target region (at least 10% per side) from the decoded screenshot."""
     actual_w, actual_h = img.size
 
     # Compute crop rect from the coarse target + padding, clamped to [0,1]
@@ -585,7 +755,18 @@ def _crop_and_draw_sub_markers(
     top = int(cy * actual_h)
     right = int((cx + cw) * actual_w)
     bottom = int((cy + ch) * actual_h)
-    cropped = img.crop((left, top, right, bottom))
+    return crop_rect, img.crop((left, top, right, bottom))
+
+
+def _draw_sub_markers(
+    crop_rect: CropRect,
+    cropped: Image.Image,
+) -> tuple[CropRect, bytes, list[dict]]:
+    """
+    Draw the numbered sub-grid on an already-cropped region (runs in the Pillow
+    process pool). Returns (crop_rect, marked_crop_bytes, sub_markers).
+    """
+    cx, cy, cw, ch = crop_rect.cx, crop_rect.cy, crop_rect.cw, crop_rect.ch
     crop_w, crop_h = cropped.size
 
     # Sub-markers must be SMALL so they don't obscure the UI underneath.
@@ -598,51 +779,38 @@ def _crop_and_draw_sub_markers(
     border_w = max(1, sub_radius // 6)
 
     # Generate sub-markers on a dense 12x12 grid within the crop
-    sub_markers = []
-    for row in range(REFINE_SUB_ROWS):
-        for col in range(REFINE_SUB_COLS):
-            sub_cx = (col + 0.5) / REFINE_SUB_COLS
-            sub_cy = (row + 0.5) / REFINE_SUB_ROWS
-            sub_markers.append({
-                "id": len(sub_markers),
-                "cx_crop": sub_cx,
-                "cy_crop": sub_cy,
-                # Full-image normalized position
-                "cx_full": cx + sub_cx * cw,
-                "cy_full": cy + sub_cy * ch,
-            })
-
-    # Draw sub-markers on the crop
-    cropped_rgba = cropped.convert("RGBA")
-    overlay = Image.new("RGBA", cropped_rgba.size, (0, 0, 0, 0))
-    draw = ImageDraw.Draw(overlay)
-
-    try:
-        font = ImageFont.truetype("/System/Library/Fonts/Helvetica.ttc", sub_font_size)
-    except Exception:
-        font = ImageFont.load_default()
+    sub_markers = [
+        {
+            "id": i,
+            "cx_crop": sub_cx,
+            "cy_crop": sub_cy,
+            # Full-image normalized position
+            "cx_full": cx + sub_cx * cw,
+            "cy_full": cy + sub_cy * ch,
+        }
+        for i, sub_cx, sub_cy in _SUB_GRID
+    ]
+
+    # Draw sub-markers straight onto the crop (RGBA context blends in place)
+    if cropped.mode != "RGB":
+        cropped = cropped.convert("RGB")
+    draw = ImageDraw.Draw(cropped, "RGBA")
+
+    font = get_label_font(sub_font_size)
+    # More opaque fill — readable markers, UI still slightly visible underneath
+    sprite = _marker_sprite(sub_radius, border_w, (255, 255, 255, 180), (30, 120, 255, 230))
 
     for m in sub_markers:
         px = m["cx_crop"] * crop_w
         py = m["cy_crop"] * crop_h
         r = sub_radius
-        # More opaque fill — readable markers, UI still slightly visible underneath
-        draw.ellipse([px - r, py - r, px + r, py + r],
-                     fill=(255, 255, 255, 180),
-                     outline=(30, 120, 255, 230),
-                     width=border_w)
+        cropped.paste(sprite, (round(px - r), round(py - r)), sprite)
         # Number text stays opaque for readability
         text = str(m["id"])
-        bbox = draw.textbbox((0, 0), text, font=font)
-        tw = bbox[2] - bbox[0]
-        th = bbox[3] - bbox[1]
+        tw, th = label_text_size(sub_font_size, text)
         draw.text((px - tw / 2, py - th / 2), text, fill=(0, 0, 0, 230), font=font)
 
-    result = Image.alpha_composite(cropped_rgba, overlay).convert("RGB")
-    buf = io.BytesIO()
-    result.save(buf, format="PNG")
-
-    return crop_rect, buf.getvalue(), sub_markers
+    return crop_rect, _encode_som_image(cropped, _SUB_MARKER_JPEG_QUALITY), sub_markers
 
 
 # ---------------------------------------------------------------------------
@@ -650,81 +818,79 @@ def _crop_and_draw_sub_markers(
 # ---------------------------------------------------------------------------
 
 
-def _omni_plan_to_step_plan(
-    omni_plan: OmniPlanResponse,
-    elements: list[OmniElement],
-) -> StepPlan:
+def _omni_step_to_step(
+    omni_step,
+    elem_map: dict[int, OmniElement],
+) -> Step:
     """
-    Convert an OmniParser plan (element IDs per step) to a standard StepPlan.
-    Each element_id maps to a bounding box from OmniParser's detection.
-    If a step references multiple elements, they are merged into a single bbox.
+    Convert one OmniParser step to a Step: gather the referenced element
+    bboxes, merge them with a single NumPy min/max, clamp, and build the
+    TargetRect without re-validating the already-clamped coordinates.
     """
-    elem_map = {e.id: e for e in elements}
-    converted_steps: list[Step] = []
-
-    for omni_step in omni_plan.steps:
-        # Collect bboxes for all referenced elements
-        found_elements: list[OmniElement] = []
-        for eid in omni_step.element_ids:
-            elem = elem_map.get(eid)
-            if elem is None:
-                print(f"[omni] WARNING: element_id={eid} not found in OmniParser results, skipping")
-                continue
-            found_elements.append(elem)
-
-        if not found_elements:
-            # Fallback: center of screen
-            converted_steps.append(Step(
-                id=omni_step.id,
-                instruction=omni_step.instruction,
-                targets=[TargetRect(
-                    type=TargetType.bbox_norm,
-                    x=0.4, y=0.4, w=0.2, h=0.2,
-                    confidence=0.1,
-                    label="fallback — element not found",
-                )],
-                advance=omni_step.advance,
-                safety=omni_step.safety,
-            ))
+    found_elements: list[OmniElement] = []
+    for eid in omni_step.element_ids:
+        elem = elem_map.get(eid)
+        if elem is None:
+            print(f"[omni] WARNING: element_id={eid} not found in OmniParser results, skipping")
             continue
+        found_elements.append(elem)
 
-        # Compute bounding box spanning all referenced elements
-        all_x1 = [e.bbox_xyxy[0] for e in found_elements]
-        all_y1 = [e.bbox_xyxy[1] for e in found_elements]
-        all_x2 = [e.bbox_xyxy[2] for e in found_elements]
-        all_y2 = [e.bbox_xyxy[3] for e in found_elements]
-
-        merged_x1 = max(0.0, min(all_x1))
-        merged_y1 = max(0.0, min(all_y1))
-        merged_x2 = min(1.0, max(all_x2))
-        merged_y2 = min(1.0, max(all_y2))
+    if not found_elements:
+        # Fallback: center of screen
+        return Step.model_construct(
+            id=omni_step.id,
+            instruction=omni_step.instruction,
+            targets=[TargetRectBBox.model_construct(
+                type=TargetType.bbox_norm,
+                x=0.4, y=0.4, w=0.2, h=0.2,
+                confidence=0.1,
+                label="fallback — element not found",
+            )],
+            advance=omni_step.advance,
+            safety=omni_step.safety,
+        )
 
-        w = max(merged_x2 - merged_x1, 0.02)
-        h = max(merged_y2 - merged_y1, 0.02)
+    # Bounding box spanning all referenced elements (one pass over an Nx4 array),
+    # clipped to [0,1] with a 0.02 minimum size
+    xyxy = np.array([e.bbox_xyxy for e in found_elements], dtype=np.float64)
+    merged_x1, merged_y1 = np.maximum(xyxy[:, :2].min(axis=0), 0.0).tolist()
+    merged_x2, merged_y2 = np.minimum(xyxy[:, 2:].max(axis=0), 1.0).tolist()
 
-        # Clamp to ensure x+w <= 1 and y+h <= 1
-        x = min(merged_x1, 1.0 - w)
-        y = min(merged_y1, 1.0 - h)
+    w = max(merged_x2 - merged_x1, 0.02)
+    h = max(merged_y2 - merged_y1, 0.02)
 
-        # Use the first element's content as label
-        label = found_elements[0].content if found_elements else None
+    # Clamp to ensure x+w <= 1 and y+h <= 1
+    x = min(merged_x1, 1.0 - w)
+    y = min(merged_y1, 1.0 - h)
 
-        targets = [TargetRect(
+    return Step.model_construct(
+        id=omni_step.id,
+        instruction=omni_step.instruction,
+        targets=[TargetRectBBox.model_construct(
             type=TargetType.bbox_norm,
             x=x, y=y, w=w, h=h,
             confidence=omni_step.confidence,
-            label=label,
-        )]
+            # Use the first element's content as label
+            label=found_elements[0].content,
+        )],
+        advance=omni_step.advance,
+        safety=omni_step.safety,
+    )
 
-        converted_steps.append(Step(
-            id=omni_step.id,
-            instruction=omni_step.instruction,
-            targets=targets,
-            advance=omni_step.advance,
-            safety=omni_step.safety,
-        ))
 
-    return StepPlan(
+def _omni_plan_to_step_plan(
+    omni_plan: OmniPlanResponse,
+    elements: list[OmniElement],
+) -> StepPlan:
+    """
+    Convert an OmniParser plan (element IDs per step) to a standard StepPlan.
+    Each element_id maps to a bounding box from OmniParser's detection.
+    If a step references multiple elements, they are merged into a single bbox.
+    """
+    elem_map = {e.id: e for e in elements}
+    converted_steps = [_omni_step_to_step(omni_step, elem_map) for omni_step in omni_plan.steps]
+
+    return StepPlan.model_construct(
         version=omni_plan.version,
         goal=omni_plan.goal,
         image_size=omni_plan.image_size,
@@ -732,10 +898,107 @@ def _omni_plan_to_step_plan(
     )
 
 
+# ---------------------------------------------------------------------------
+# Shared refinement plumbing
+# ---------------------------------------------------------------------------
+
+# Cap on in-flight refine LLM calls per process (all steps are gathered at once).
+# Tunable via REFINE_CONCURRENCY to match the provider's rate limits.
+_REFINE_CONCURRENCY = max(1, int(os.getenv("REFINE_CONCURRENCY", "8")))
+_refine_semaphore = asyncio.Semaphore(_REFINE_CONCURRENCY)
+
+
+def _regroup_refined_targets(plan: StepPlan, refined: list[TargetRect]) -> StepPlan:
+    """
+    Rebuild a StepPlan from a flat list of refined targets, produced in
+    (step, target) order, splitting it back per step by target count.
+    """
+    refined_iter = iter(refined)
+    refined_steps = [
+        Step.model_construct(
+            id=step.id,
+            instruction=step.instruction,
+            targets=[next(refined_iter) for _ in step.targets],
+            advance=step.advance,
+            safety=step.safety,
+        )
+        for step in plan.steps
+    ]
+    return StepPlan.model_construct(
+        version=plan.version,
+        goal=plan.goal,
+        app_context=plan.app_context,
+        image_size=plan.image_size,
+        steps=refined_steps,
+    )
+
+
 # ---------------------------------------------------------------------------
 # Two-pass SoM refinement (legacy): dense sub-grid on a zoomed crop
 # ---------------------------------------------------------------------------
 
+async def _refine_target_two_pass(
+    step: Step,
+    target: TargetRect,
+    crop: tuple[CropRect, bytes, list[dict]] | BaseException,
+    request_id: str,
+) -> TargetRect:
+    """
+    Refine one coarse target from its pre-rendered sub-marker crop.
+    Returns the coarse target unchanged on any failure.
+    """
+    try:
+        if isinstance(crop, BaseException):
+            raise crop
+        crop_rect, marked_crop, sub_markers = crop
+
+        print(f"[refine2] rid={request_id} step={step.id} crop=({crop_rect.cx:.3f},{crop_rect.cy:.3f},{crop_rect.cw:.3f},{crop_rect.ch:.3f}) {len(sub_markers)} sub-markers, {len(marked_crop)} bytes")
+
+        # Save crop for debugging
+        ext = "jpg" if marked_crop[:3] == b"\xff\xd8\xff" else "png"
+        write_debug_file(f"/tmp/overlayguide_refine_subcrop.{ext}", marked_crop)
+
+        # Ask model to select sub-markers covering the element
+        async with _refine_semaphore:
+            result = await generate_som_refine(
+                instruction=step.instruction,
+                target_label=target.label or "",
+                crop_image_bytes=marked_crop,
+                request_id=request_id,
+            )
+
+        picked_ids = result.get("marker_ids", [])
+
+        # Keep only ids that exist on the sub-grid
+        n_sub = len(sub_markers)
+        found = [mid for mid in picked_ids if isinstance(mid, int) and 0 <= mid < n_sub]
+        if not found:
+            print(f"[refine2] rid={request_id} step={step.id} no valid sub-markers from {picked_ids}, keeping coarse bbox")
+            return target
+
+        # Bounding box of the selected sub-markers: index the precomputed crop
+        # grid, reduce, then map crop-normalized corners to full-image coords
+        pts = _SUB_GRID_XY[found]
+        origin = np.array([crop_rect.cx, crop_rect.cy])
+        scale = np.array([crop_rect.cw, crop_rect.ch])
+        lo = origin + pts.min(axis=0) * scale
+        hi = origin + pts.max(axis=0) * scale
+
+        # Pad, keep inside the screen, and ensure minimum size — at least
+        # ~40x30 pixels on a 1512x982 screen (x/y handled together)
+        pad = _REFINED_BBOX_PAD
+        rx, ry, rw, rh = _clamp_bbox(lo - pad, hi - lo + pad * 2, min_size=0.025)
+
+        refined = _bbox_target(rx, ry, rw, rh, result.get("confidence"), result.get("label"))
+        ids_str = ",".join(str(i) for i in picked_ids)
+        print(f"[refine2] rid={request_id} step={step.id} sub-markers=[{ids_str}] ({len(found)} valid) -> bbox ({rx:.3f},{ry:.3f},{rw:.3f},{rh:.3f})")
+        return refined
+
+    except Exception as e:
+        print(f"[refine2] rid={request_id} step={step.id} two-pass refine failed: {e}, keeping coarse bbox")
+        return target
+
+
 async def _refine_plan_two_pass(
     plan: StepPlan,
     original_screenshot_bytes: bytes,
@@ -746,90 +1009,38 @@ async def _refine_plan_two_pass(
     region, draw a dense 12x12 sub-grid, ask the model to select all
     sub-markers covering the element. Bbox is computed from the bounding
     rectangle of all selected sub-markers. No raw coordinate guessing.
+    All targets are refined concurrently.
     """
-    refined_steps: list[Step] = []
+    # Decode the screenshot once; only the small crops are shipped to the pool
+    try:
+        img = await asyncio.to_thread(_decode_rgb, original_screenshot_bytes)
+    except Exception as e:
+        print(f"[refine2] rid={request_id} screenshot decode failed: {e}, keeping coarse bboxes")
+        return plan
 
+    regions: list[tuple[CropRect, Image.Image] | BaseException] = []
     for step in plan.steps:
-        refined_targets: list[TargetRect] = []
-
         for target in step.targets:
             try:
-                crop_rect, marked_crop, sub_markers = _crop_and_draw_sub_markers(
-                    original_screenshot_bytes, target
-                )
-
-                print(f"[refine2] rid={request_id} step={step.id} crop=({crop_rect.cx:.3f},{crop_rect.cy:.3f},{crop_rect.cw:.3f},{crop_rect.ch:.3f}) {len(sub_markers)} sub-markers, {len(marked_crop)} bytes")
-
-                # Save crop for debugging
-                try:
-                    with open("/tmp/overlayguide_refine_subcrop.png", "wb") as f:
-                        f.write(marked_crop)
-                except Exception:
-                    pass
-
-                # Ask model to select sub-markers covering the element
-                result = await generate_som_refine(
-                    instruction=step.instruction,
-                    target_label=target.label or "",
-                    crop_image_bytes=marked_crop,
-                    request_id=request_id,
-                )
-
-                picked_ids = result.get("marker_ids", [])
-                sub_map = {m["id"]: m for m in sub_markers}
-
-                # Find all valid sub-markers
-                found = [sub_map[mid] for mid in picked_ids if mid in sub_map]
-                if not found:
-                    print(f"[refine2] rid={request_id} step={step.id} no valid sub-markers from {picked_ids}, keeping coarse bbox")
-                    refined_targets.append(target)
-                    continue
-
-                # Compute bounding box of all selected sub-markers (full-image coords)
-                min_x = min(m["cx_full"] for m in found)
-                max_x = max(m["cx_full"] for m in found)
-                min_y = min(m["cy_full"] for m in found)
-                max_y = max(m["cy_full"] for m in found)
-
-                pad = _REFINED_BBOX_PAD
-                rx = max(0.0, min_x - pad)
-                ry = max(0.0, min_y - pad)
-                rw = min(max_x - min_x + pad * 2, 1.0 - rx)
-                rh = min(max_y - min_y + pad * 2, 1.0 - ry)
-
-                # Ensure minimum size — at least ~40x30 pixels on a 1512x982 screen
-                rw = max(rw, 0.025)
-                rh = max(rh, 0.025)
-
-                refined = TargetRect(
-                    type=TargetType.bbox_norm,
-                    x=rx, y=ry, w=rw, h=rh,
-                    confidence=result.get("confidence"),
-                    label=result.get("label"),
-                )
-                ids_str = ",".join(str(i) for i in picked_ids)
-                print(f"[refine2] rid={request_id} step={step.id} sub-markers=[{ids_str}] ({len(found)} valid) -> bbox ({rx:.3f},{ry:.3f},{rw:.3f},{rh:.3f})")
-                refined_targets.append(refined)
-
+                regions.append(_crop_sub_region(img, target))
             except Exception as e:
-                print(f"[refine2] rid={request_id} step={step.id} two-pass refine failed: {e}, keeping coarse bbox")
-                refined_targets.append(target)
+                regions.append(e)
 
-        refined_steps.append(Step(
-            id=step.id,
-            instruction=step.instruction,
-            targets=refined_targets,
-            advance=step.advance,
-            safety=step.safety,
-        ))
+    # Draw every step's sub-marker grid up front, off the event loop
+    async def _render(region):
+        if isinstance(region, BaseException):
+            raise region
+        return await asyncio.to_thread(_draw_sub_markers, *region)
 
-    return StepPlan(
-        version=plan.version,
-        goal=plan.goal,
-        app_context=plan.app_context,
-        image_size=plan.image_size,
-        steps=refined_steps,
-    )
+    crops = await asyncio.gather(*(_render(r) for r in regions), return_exceptions=True)
+    crop_iter = iter(crops)
+
+    refined = await asyncio.gather(*(
+        _refine_target_two_pass(step, target, next(crop_iter), request_id)
+        for step in plan.steps
+        for target in step.targets
+    ))
+    return _regroup_refined_targets(plan, refined)
 
 
 # ---------------------------------------------------------------------------
@@ -847,41 +1058,40 @@ _OMNI_MIN_CROP = 0.20
 # snap the crop to that edge (don't leave a tiny gap).
 _EDGE_SNAP_THRESHOLD = 0.15
 
+# Refine crops are only encoded for the LLM, so JPEG is plenty and several
+# times smaller than PNG for screenshot content.
+_CROP_JPEG_QUALITY = 85
 
-def _crop_region(
-    original_bytes: bytes,
-    target_rect: TargetRect,
-) -> tuple[CropRect, bytes]:
+
+def _compute_crop_box(
+    x: float, y: float, w: float, h: float,
+) -> tuple[float, float, float, float]:
     """
-    Crop a region around the coarse target from the original screenshot.
-    Edge-aware: if the target is near a screen edge, the crop extends
-    all the way to that edge so we don't miss elements at the boundary.
-    Returns (crop_rect, cropped_png_bytes). No markers or boxes drawn.
+    Pure float geometry for _crop_region: pad the target, enforce the minimum
+    crop size, snap to nearby screen edges, and clamp to [0,1].
+    Returns (cx, cy, cw, ch) in full-image normalized coords.
     """
-    img = Image.open(io.BytesIO(original_bytes))
-    actual_w, actual_h = img.size
-
     pad = _OMNI_REFINE_PADDING
-    cx = target_rect.x - pad
-    cy = target_rect.y - pad
-    cw = target_rect.w + pad * 2
-    ch = target_rect.h + pad * 2
+    cx = x - pad
+    cy = y - pad
+    cw = w + pad * 2
+    ch = h + pad * 2
 
     # Ensure minimum crop size (centered on the target)
     if cw < _OMNI_MIN_CROP:
-        center = target_rect.x + target_rect.w / 2
+        center = x + w / 2
         cx = center - _OMNI_MIN_CROP / 2
         cw = _OMNI_MIN_CROP
     if ch < _OMNI_MIN_CROP:
-        center = target_rect.y + target_rect.h / 2
+        center = y + h / 2
         cy = center - _OMNI_MIN_CROP / 2
         ch = _OMNI_MIN_CROP
 
     # Edge snapping: if the crop is near a screen edge, extend to that edge.
     # This prevents missing elements at the very edge of the screen
     # (e.g. Apple menu at x=0, Dock at y=0.95, menu bar at y=0).
-    target_cx = target_rect.x + target_rect.w / 2
-    target_cy = target_rect.y + target_rect.h / 2
+    target_cx = x + w / 2
+    target_cy = y + h / 2
 
     # Snap to left edge
     if target_cx < _EDGE_SNAP_THRESHOLD:
@@ -904,17 +1114,112 @@ def _crop_region(
     cw = min(cw, 1.0 - cx)
     ch = min(ch, 1.0 - cy)
 
+    return cx, cy, cw, ch
+
+
+def _crop_region(
+    img: Image.Image,
+    target_rect: TargetRect,
+) -> tuple[CropRect, Image.Image]:
+    """
+    Crop a region around the coarse target from the decoded (RGB) original
+    screenshot, so callers refining many targets decode it only once.
+    Edge-aware: if the target is near a screen edge, the crop extends
+    all the way to that edge so we don't miss elements at the boundary.
+    Returns (crop_rect, cropped_image). The crop stays decoded so YOLO can
+    consume it directly; nothing is drawn or encoded here.
+    """
+    actual_w, actual_h = img.size
+    cx, cy, cw, ch = _compute_crop_box(target_rect.x, target_rect.y, target_rect.w, target_rect.h)
+
     crop_rect = CropRect(cx=cx, cy=cy, cw=cw, ch=ch)
 
     left = int(cx * actual_w)
     top = int(cy * actual_h)
     right = int((cx + cw) * actual_w)
     bottom = int((cy + ch) * actual_h)
-    cropped = img.crop((left, top, right, bottom)).convert("RGB")
+    return crop_rect, img.crop((left, top, right, bottom))
 
-    buf = io.BytesIO()
-    cropped.save(buf, format="PNG")
-    return crop_rect, buf.getvalue()
+
+async def _refine_target_omniparser(
+    step: Step,
+    target: TargetRect,
+    crop_rect: CropRect,
+    crop_img: Image.Image,
+    elements: list[OmniElement],
+    request_id: str,
+) -> TargetRect:
+    """
+    Refine one coarse target from its crop and the YOLO elements detected
+    in it: numbered boxes → LLM pick → map back to full-image coords.
+    The crop is only encoded here, for the LLM, once it has elements.
+    Returns the coarse target unchanged on any failure.
+    """
+    try:
+        print(f"[hybrid] rid={request_id} step={step.id} YOLO detected {len(elements)} elements in crop")
+
+        if not elements:
+            print(f"[hybrid] rid={request_id} step={step.id} no elements in crop, keeping coarse bbox")
+            return target
+
+        # 3. Draw numbered boxes on the crop
+        # (encode + draw in worker threads so the event loop keeps serving other steps)
+        crop_bytes, annotated_crop = await asyncio.gather(
+            asyncio.to_thread(_encode_jpeg, crop_img, _CROP_JPEG_QUALITY),
+            asyncio.to_thread(draw_numbered_boxes, crop_img, elements),
+        )
+
+        # Save crop for debugging
+        write_debug_file(f"/tmp/overlayguide_hybrid_crop_{step.id}.jpg", annotated_crop)
+
+        # 4. Ask LLM to pick the element
+        elements_ctx = format_elements_context(elements)
+        async with _refine_semaphore:
+            result = await generate_omniparser_refine(
+                instruction=step.instruction,
+                target_label=target.label or "",
+                crop_image_bytes=annotated_crop,
+                elements_context=elements_ctx,
+                request_id=request_id,
+                raw_crop_bytes=crop_bytes,
+            )
+
+        picked_ids = result.get("element_ids", [])
+        elem_map = {e.id: e for e in elements}
+
+        # Find all valid elements
+        found = [elem_map[eid] for eid in picked_ids if eid in elem_map]
+        if not found:
+            print(f"[hybrid] rid={request_id} step={step.id} no valid elements from {picked_ids}, keeping coarse bbox")
+            return target
+
+        # 5. Compute bbox from selected elements and map to full-image coords
+        # Element bboxes are crop-relative [0,1] → convert to full-image [0,1]
+        xyxy = np.array([e.bbox_xyxy for e in found], dtype=np.float64)
+
+        # Crop-relative → full-image (x/y handled together)
+        origin = np.array([crop_rect.cx, crop_rect.cy])
+        scale = np.array([crop_rect.cw, crop_rect.ch])
+        full_lo = origin + xyxy[:, :2].min(axis=0) * scale
+        full_hi = origin + xyxy[:, 2:].max(axis=0) * scale
+
+        # Guard against inverted coordinates (bad YOLO detection)
+        if np.any(full_hi <= full_lo):
+            print(f"[hybrid] rid={request_id} step={step.id} inverted bbox, keeping coarse")
+            return target
+
+        # Width/height from the actual extent, at least 0.02; the origin is
+        # shifted back as needed so the bbox stays within [0,1]
+        rx, ry, rw, rh = _clamp_bbox(full_lo, full_hi - full_lo)
+
+        refined = _bbox_target(rx, ry, rw, rh, result.get("confidence"), result.get("label"))
+        ids_str = ",".join(str(i) for i in picked_ids)
+        print(f"[hybrid] rid={request_id} step={step.id} elements=[{ids_str}] ({len(found)} valid) -> bbox ({rx:.3f},{ry:.3f},{rw:.3f},{rh:.3f}) label={result.get('label')!r}")
+        return refined
+
+    except Exception as e:
+        print(f"[hybrid] rid={request_id} step={step.id} OmniParser refine failed: {e}, keeping coarse bbox")
+        return target
 
 
 async def _refine_with_omniparser(
@@ -931,120 +1236,83 @@ async def _refine_with_omniparser(
       3. Draw numbered boxes on the crop.
       4. Ask the LLM to pick which element is the target.
       5. Map the crop-relative bbox back to full-image coordinates.
+    Crops are taken first, YOLO runs once over all of them, then every
+    target's LLM pick runs concurrently.
     """
-    refined_steps: list[Step] = []
+    pairs = [(step, target) for step in plan.steps for target in step.targets]
 
-    for step in plan.steps:
-        refined_targets: list[TargetRect] = []
+    # 1. Decode the screenshot once, then crop every target's region from it
+    try:
+        img = await asyncio.to_thread(_decode_rgb, original_screenshot_bytes)
+    except Exception as e:
+        print(f"[hybrid] rid={request_id} screenshot decode failed: {e}, keeping coarse bboxes")
+        return plan
+    crops: list[tuple[CropRect, Image.Image] | None] = []
+    for step, target in pairs:
+        try:
+            crop_rect, crop_img = _crop_region(img, target)
+            print(f"[hybrid] rid={request_id} step={step.id} crop=({crop_rect.cx:.3f},{crop_rect.cy:.3f},{crop_rect.cw:.3f},{crop_rect.ch:.3f})")
+            crops.append((crop_rect, crop_img))
+        except Exception as e:
+            print(f"[hybrid] rid={request_id} step={step.id} crop failed: {e}, keeping coarse bbox")
+            crops.append(None)
 
-        for target in step.targets:
-            try:
-                # 1. Crop the region
-                crop_rect, crop_bytes = _crop_region(
-                    original_screenshot_bytes, target
-                )
-                print(f"[hybrid] rid={request_id} step={step.id} crop=({crop_rect.cx:.3f},{crop_rect.cy:.3f},{crop_rect.cw:.3f},{crop_rect.ch:.3f})")
+    # 2. One batched YOLO pass over all crops
+    valid = [i for i, c in enumerate(crops) if c is not None]
+    try:
+        batch = await asyncio.to_thread(detect_elements_batch, [crops[i][1] for i in valid])
+    except Exception as e:
+        print(f"[hybrid] rid={request_id} batched YOLO failed: {e}, keeping coarse bboxes")
+        return plan
+    elements_by_idx = dict(zip(valid, batch))
 
-                # 2. Run YOLO on the crop
-                elements = detect_elements(crop_bytes)
-                print(f"[hybrid] rid={request_id} step={step.id} YOLO detected {len(elements)} elements in crop")
+    # 3-5. Ask the LLM for every cropped target concurrently
+    refined = [target for _, target in pairs]
+    results = await asyncio.gather(*(
+        _refine_target_omniparser(*pairs[i], *crops[i], elements_by_idx[i], request_id)
+        for i in valid
+    ))
+    for i, result in zip(valid, results):
+        refined[i] = result
+    return _regroup_refined_targets(plan, refined)
 
-                if not elements:
-                    print(f"[hybrid] rid={request_id} step={step.id} no elements in crop, keeping coarse bbox")
-                    refined_targets.append(target)
-                    continue
 
-                # 3. Draw numbered boxes on the crop
-                annotated_crop = draw_numbered_boxes(crop_bytes, elements)
+# ---------------------------------------------------------------------------
+# Full-screenshot YOLO pass shared by /start and /plan-stream
+# ---------------------------------------------------------------------------
 
-                # Save crop for debugging
-                try:
-                    with open(f"/tmp/overlayguide_hybrid_crop_{step.id}.png", "wb") as f:
-                        f.write(annotated_crop)
-                except Exception:
-                    pass
-
-                # 4. Ask LLM to pick the element
-                elements_ctx = format_elements_context(elements)
-                result = await generate_omniparser_refine(
-                    instruction=step.instruction,
-                    target_label=target.label or "",
-                    crop_image_bytes=annotated_crop,
-                    elements_context=elements_ctx,
-                    request_id=request_id,
-                    raw_crop_bytes=crop_bytes,
-                )
+# The overlay and context text depend only on the elements, so they are
+# cached per screenshot alongside detect_elements' own cache.
+_ANNOTATE_CACHE_MAX = 128
+_annotate_cache: LRUCache = LRUCache(maxsize=_ANNOTATE_CACHE_MAX)
+_annotate_cache_lock = threading.Lock()
 
-                picked_ids = result.get("element_ids", [])
-                elem_map = {e.id: e for e in elements}
-
-                # Find all valid elements
-                found = [elem_map[eid] for eid in picked_ids if eid in elem_map]
-                if not found:
-                    print(f"[hybrid] rid={request_id} step={step.id} no valid elements from {picked_ids}, keeping coarse bbox")
-                    refined_targets.append(target)
-                    continue
-
-                # 5. Compute bbox from selected elements and map to full-image coords
-                # Element bboxes are crop-relative [0,1] → convert to full-image [0,1]
-                all_x1 = [e.bbox_xyxy[0] for e in found]
-                all_y1 = [e.bbox_xyxy[1] for e in found]
-                all_x2 = [e.bbox_xyxy[2] for e in found]
-                all_y2 = [e.bbox_xyxy[3] for e in found]
-
-                # Crop-relative → full-image
-                full_x1 = crop_rect.cx + min(all_x1) * crop_rect.cw
-                full_y1 = crop_rect.cy + min(all_y1) * crop_rect.ch
-                full_x2 = crop_rect.cx + max(all_x2) * crop_rect.cw
-                full_y2 = crop_rect.cy + max(all_y2) * crop_rect.ch
-
-                # Guard against inverted coordinates (bad YOLO detection)
-                if full_x2 <= full_x1 or full_y2 <= full_y1:
-                    print(f"[hybrid] rid={request_id} step={step.id} inverted bbox, keeping coarse")
-                    refined_targets.append(target)
-                    continue
-
-                # Clamp origin to [0,1]
-                rx = max(0.0, min(full_x1, 1.0))
-                ry = max(0.0, min(full_y1, 1.0))
-
-                # Compute width/height from the actual bbox extent
-                rw = max(full_x2 - full_x1, 0.02)
-                rh = max(full_y2 - full_y1, 0.02)
-
-                # Clamp so bbox stays within [0,1]
-                rw = min(rw, 1.0 - rx)
-                rh = min(rh, 1.0 - ry)
-
-                refined = TargetRect(
-                    type=TargetType.bbox_norm,
-                    x=rx, y=ry, w=rw, h=rh,
-                    confidence=result.get("confidence"),
-                    label=result.get("label"),
-                )
-                ids_str = ",".join(str(i) for i in picked_ids)
-                print(f"[hybrid] rid={request_id} step={step.id} elements=[{ids_str}] ({len(found)} valid) -> bbox ({rx:.3f},{ry:.3f},{rw:.3f},{rh:.3f}) label={result.get('label')!r}")
-                refined_targets.append(refined)
 
-            except Exception as e:
-                print(f"[hybrid] rid={request_id} step={step.id} OmniParser refine failed: {e}, keeping coarse bbox")
-                refined_targets.append(target)
+def _detect_and_annotate(screenshot_bytes: bytes) -> tuple[list[OmniElement], bytes, str]:
+    """
+    Run YOLO on the full screenshot, number elements in reading order
+    (top-to-bottom, left-to-right), and draw the numbered overlay.
+    Blocking — call via asyncio.to_thread from request handlers.
+    Repeat screenshots reuse the cached overlay and context.
+    Returns (elements, annotated_bytes, elements_context).
+    """
+    elements = detect_elements(screenshot_bytes)
+    elements.sort(key=lambda e: (e.bbox_xyxy[1], e.bbox_xyxy[0]))
+    for i, e in enumerate(elements):
+        e.id = i
 
-        refined_steps.append(Step(
-            id=step.id,
-            instruction=step.instruction,
-            targets=refined_targets,
-            advance=step.advance,
-            safety=step.safety,
-        ))
+    key = screenshot_digest(screenshot_bytes)
+    with _annotate_cache_lock:
+        cached = _annotate_cache.get(key)
+    if cached is not None:
+        annotated_bytes, elements_ctx = cached
+    else:
+        annotated_bytes = draw_numbered_boxes(screenshot_bytes, elements)
+        elements_ctx = format_elements_context(elements)
+        with _annotate_cache_lock:
+            _annotate_cache[key] = (annotated_bytes, elements_ctx)
 
-    return StepPlan(
-        version=plan.version,
-        goal=plan.goal,
-        app_context=plan.app_context,
-        image_size=plan.image_size,
-        steps=refined_steps,
-    )
+    return elements, annotated_bytes, elements_ctx
 
 
 @router.post("/start")
@@ -1059,12 +1327,10 @@ async def start_session(
     Returns a session_id that /plan-stream can reference to skip YOLO.
     """
     request_id = getattr(request.state, "request_id", "unknown")
-    _prune_sessions()
 
     try:
-        size_dict = json.loads(image_size)
-        parsed_size = ImageSize.model_validate(size_dict)
-    except (json.JSONDecodeError, Exception) as e:
+        parsed_size = ImageSize.model_validate_json(image_size)
+    except ValidationError as e:
         raise HTTPException(status_code=422, detail=f"Invalid image_size JSON: {e}")
 
     screenshot_bytes = await screenshot.read()
@@ -1076,22 +1342,23 @@ async def start_session(
     session_id = str(uuid4())
     print(f"[start] rid={request_id} sid={session_id} running YOLO on {len(screenshot_bytes)} bytes")
 
-    # Run YOLO detection (the slow part we want to pre-compute)
-    elements = detect_elements(screenshot_bytes)
-    elements.sort(key=lambda e: (e.bbox_xyxy[1], e.bbox_xyxy[0]))
-    for i, e in enumerate(elements):
-        e.id = i
-
-    annotated_bytes = draw_numbered_boxes(screenshot_bytes, elements)
-    elements_ctx = format_elements_context(elements)
+    # Run YOLO detection (the slow part we want to pre-compute) off the event loop
+    elements, annotated_bytes, elements_ctx = await asyncio.to_thread(
+        _detect_and_annotate, screenshot_bytes
+    )
 
     # Upload images to Gemini File API so /plan-stream can skip base64 re-encoding
     gemini_annotated_file = None
     gemini_raw_file = None
     if is_native_genai_available():
         try:
-            gemini_annotated_file, gemini_raw_file = upload_images_to_gemini(
-                annotated_bytes, screenshot_bytes
+            annotated_jpeg, raw_jpeg = await asyncio.gather(
+                asyncio.to_thread(_encode_for_gemini, annotated_bytes),
+                asyncio.to_thread(_encode_for_gemini, screenshot_bytes),
+            )
+            # The File API upload is a blocking HTTP call — keep it off the loop
+            gemini_annotated_file, gemini_raw_file = await asyncio.to_thread(
+                upload_images_to_gemini, annotated_jpeg, raw_jpeg, mime_type="image/jpeg",
             )
             print(f"[start] rid={request_id} sid={session_id} images uploaded to Gemini")
         except Exception as e:
@@ -1112,6 +1379,216 @@ async def start_session(
     return {"session_id": session_id, "element_count": len(elements)}
 
 
+# ---------------------------------------------------------------------------
+# Two-pass zoom pipeline, Pass 2 (shared by /plan and /next):
+# crop around each Pass 1 box → YOLO → identify the exact element
+# ---------------------------------------------------------------------------
+
+def _pass2_crop_region(
+    loc_x: float, loc_y: float, loc_w: float, loc_h: float,
+) -> tuple[float, float, float, float]:
+    """Generous normalized crop around a Pass 1 box: 6% padding, at least 10% per side."""
+    pad = 0.06  # 6% padding on each side
+    crop_x = max(0.0, loc_x - pad)
+    crop_y = max(0.0, loc_y - pad)
+    crop_w = min(loc_w + pad * 2, 1.0 - crop_x)
+    crop_h = min(loc_h + pad * 2, 1.0 - crop_y)
+
+    # Ensure minimum crop size so YOLO has context
+    min_crop = 0.10
+    if crop_w < min_crop:
+        center = loc_x + loc_w / 2
+        crop_x = max(0.0, center - min_crop / 2)
+        crop_w = min(min_crop, 1.0 - crop_x)
+    if crop_h < min_crop:
+        center = loc_y + loc_h / 2
+        crop_y = max(0.0, center - min_crop / 2)
+        crop_h = min(min_crop, 1.0 - crop_y)
+    return crop_x, crop_y, crop_w, crop_h
+
+
+async def _resolve_step_two_pass(
+    step_data: dict,
+    index: int,
+    region: tuple[tuple, tuple, Image.Image] | None,
+    crop_elements: list[OmniElement],
+    dbg: DebugSession,
+    request_id: str,
+    tag: str,
+) -> Step:
+    """
+    Resolve one Pass 1 step to a Step: ask the model to pick the exact YOLO
+    element on its zoomed crop, falling back to snapping the Pass 1 box.
+    `region` is (loc, crop, crop_img), or None when box_2d was unusable.
+    """
+    step_id = step_data.get("id", f"s{index + 1}")
+    instruction = step_data.get("instruction", "")
+    label = step_data.get("label", "")
+    confidence = step_data.get("confidence", 0.5)
+    advance_type = step_data.get("advance", "click_in_target")
+    box_2d = step_data.get("box_2d", [])
+
+    print(f"[{tag}] rid={request_id} step={step_id} Pass 1 box_2d={box_2d} label={label!r}")
+
+    if region is None:
+        print(f"[{tag}] rid={request_id} step={step_id} invalid box_2d, using center fallback")
+        return Step(
+            id=step_id, instruction=instruction,
+            targets=[_bbox_target(0.4, 0.4, 0.2, 0.2, 0.1, label)],
+            advance=_advance(advance_type),
+        )
+
+    (loc_x, loc_y, loc_w, loc_h), (crop_x, crop_y, crop_w, crop_h), crop_img = region
+    print(f"[{tag}] rid={request_id} step={step_id} crop=({crop_x:.3f},{crop_y:.3f},{crop_w:.3f},{crop_h:.3f}) "
+          f"pixels=({crop_img.width}x{crop_img.height})")
+
+    crop_elements.sort(key=lambda e: (e.bbox_xyxy[1], e.bbox_xyxy[0]))
+    for i, e in enumerate(crop_elements):
+        e.id = i
+
+    print(f"[{tag}] rid={request_id} step={step_id} YOLO on crop: {len(crop_elements)} elements")
+
+    if not crop_elements:
+        # No elements found — use Pass 1 raw coordinates
+        print(f"[{tag}] rid={request_id} step={step_id} no YOLO elements in crop, using Pass 1 coords")
+        rx, ry, rw, rh = loc_x, loc_y, loc_w, loc_h
+    else:
+        # Encode the clean crop and draw numbered boxes on it (off the event loop)
+        raw_crop_bytes, annotated_crop = await asyncio.gather(
+            asyncio.to_thread(_encode_png, crop_img),
+            asyncio.to_thread(draw_numbered_boxes, crop_img, crop_elements),
+        )
+        crop_ctx = format_elements_context(crop_elements)
+
+        # Save crop debug images
+        dbg.save_image(f"pass2_{step_id}_crop_raw", raw_crop_bytes)
+        dbg.save_image(f"pass2_{step_id}_crop_annotated", annotated_crop,
+                       f"{len(crop_elements)} elements")
+        dbg.save_text(f"pass2_{step_id}_elements", crop_ctx)
+
+        # Ask Gemini to pick the exact element on the zoomed crop
+        identify_result = await generate_identify_element(
+            instruction=instruction,
+            label=label,
+            annotated_crop_bytes=annotated_crop,
+            raw_crop_bytes=raw_crop_bytes,
+            elements_context=crop_ctx,
+            request_id=request_id,
+        )
+
+        # Save Pass 2 debug
+        id_debug = identify_result.pop("_debug", {})
+        if id_debug:
+            dbg.save_prompt_and_response(
+                f"pass2_{step_id}_identify",
+                prompt=id_debug.get("prompt", ""),
+                response=id_debug.get("raw_response", ""),
+                model=id_debug.get("model", ""),
+            )
+
+        picked_id = identify_result.get("element_id")
+        crop_elem_map = {e.id: e for e in crop_elements}
+
+        if picked_id is not None and picked_id in crop_elem_map:
+            # Map crop-relative bbox back to full-screen coordinates
+            ce = crop_elem_map[picked_id]
+            ce_x, ce_y, ce_w, ce_h = ce.bbox_xywh
+            rx = crop_x + ce_x * crop_w
+            ry = crop_y + ce_y * crop_h
+            rw = ce_w * crop_w
+            rh = ce_h * crop_h
+            confidence = identify_result.get("confidence", confidence)
+            print(f"[{tag}] rid={request_id} step={step_id} Pass 2 picked elem[{picked_id}] "
+                  f"-> full ({rx:.3f},{ry:.3f},{rw:.3f},{rh:.3f}) "
+                  f"reasoning: {identify_result.get('reasoning', '')[:80]}")
+        else:
+            # Fallback: snap Pass 1 box_2d to nearest YOLO crop element
+            rel_x = (loc_x - crop_x) / crop_w
+            rel_y = (loc_y - crop_y) / crop_h
+            rel_w = loc_w / crop_w
+            rel_h = loc_h / crop_h
+            snap_x, snap_y, snap_w, snap_h, snap_id = snap_to_nearest_element(
+                rel_x, rel_y, rel_w, rel_h, crop_elements
+            )
+            rx = crop_x + snap_x * crop_w
+            ry = crop_y + snap_y * crop_h
+            rw = snap_w * crop_w
+            rh = snap_h * crop_h
+            print(f"[{tag}] rid={request_id} step={step_id} Pass 2 no valid pick, "
+                  f"snapped to elem[{snap_id}] -> full ({rx:.3f},{ry:.3f},{rw:.3f},{rh:.3f})")
+
+    rx, ry, rw, rh = _clamp_bbox((rx, ry), (rw, rh))
+
+    # Save per-step resolution trace
+    dbg.save_step_resolution(
+        step_id=step_id,
+        step_data=step_data,
+        resolved_bbox=(rx, ry, rw, rh),
+    )
+
+    return Step(
+        id=step_id,
+        instruction=instruction,
+        targets=[_bbox_target(rx, ry, rw, rh, confidence, label)],
+        advance=_advance(advance_type),
+    )
+
+
+async def _resolve_steps_two_pass(
+    raw_steps: list[dict],
+    img: Image.Image,
+    dbg: DebugSession,
+    request_id: str,
+    tag: str,
+) -> list[Step]:
+    """
+    Pass 2 for every Pass 1 step. Crops are cut up front and run through
+    YOLO in one batched predict; the per-step identify calls have no data
+    dependency on each other, so they run concurrently (wall clock is the
+    slowest step, not the sum). Steps come back in Pass 1 order.
+    """
+    actual_w, actual_h = img.size
+    regions: list[tuple[tuple, tuple, Image.Image] | None] = []
+    for step_data in raw_steps:
+        box_2d = step_data.get("box_2d", [])
+        if not box_2d or len(box_2d) != 4:
+            regions.append(None)
+            continue
+        ymin, xmin, ymax, xmax = box_2d
+        loc = (xmin / 1000.0, ymin / 1000.0, (xmax - xmin) / 1000.0, (ymax - ymin) / 1000.0)
+        crop = _pass2_crop_region(*loc)
+        crop_x, crop_y, crop_w, crop_h = crop
+        crop_img = img.crop((
+            int(crop_x * actual_w),
+            int(crop_y * actual_h),
+            int((crop_x + crop_w) * actual_w),
+            int((crop_y + crop_h) * actual_h),
+        ))
+        regions.append((loc, crop, crop_img))
+
+    # One YOLO predict over every crop instead of one call per step
+    valid = [i for i, r in enumerate(regions) if r is not None]
+    batch = await asyncio.to_thread(detect_elements_batch, [regions[i][2] for i in valid])
+    elements_by_idx = dict(zip(valid, batch))
+
+    tasks = [
+        asyncio.ensure_future(_resolve_step_two_pass(
+            step_data, i, regions[i], elements_by_idx.get(i, []), dbg, request_id, tag,
+        ))
+        for i, step_data in enumerate(raw_steps)
+    ]
+    try:
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        # One step failed (or the request was cancelled): stop the sibling
+        # identify calls so they don't keep spending rate-limiter budget.
+        # The original exception still propagates, not an ExceptionGroup.
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
 @router.post("/plan", response_model=StepPlan)
 async def create_plan(
     request: Request,
@@ -1136,9 +1613,8 @@ async def create_plan(
 
     # --- Parse and validate image_size ---
     try:
-        size_dict = json.loads(image_size)
-        parsed_size = ImageSize.model_validate(size_dict)
-    except (json.JSONDecodeError, Exception) as e:
+        parsed_size = ImageSize.model_validate_json(image_size)
+    except ValidationError as e:
         raise HTTPException(status_code=422, detail=f"Invalid image_size JSON: {e}")
 
     # --- Mock mode ---
@@ -1160,6 +1636,9 @@ async def create_plan(
     dbg = DebugSession(request_id, goal=goal, endpoint="plan")
 
     try:
+        # Search and Pass 1 both send the raw screenshot: base64-encode it once
+        screenshot_url = _image_data_url(screenshot_bytes)
+
         # ===== STEP 0: Kick off web search concurrently (non-blocking) =====
         search_task = None
         if not skip_search:
@@ -1170,6 +1649,7 @@ async def create_plan(
                         screenshot_bytes=screenshot_bytes,
                         app_context=app_context,
                         request_id=request_id,
+                        screenshot_url=screenshot_url,
                     )
                 except Exception as e:
                     print(f"[plan] rid={request_id} search failed (non-fatal): {type(e).__name__}: {e}")
@@ -1190,13 +1670,19 @@ async def create_plan(
                 print(f"[plan] rid={request_id} search returned {len(search_context)} chars of context")
                 dbg.save_text("search_context", search_context)
 
-        from app.services.agent import generate_locate_steps, generate_identify_element
+        # Decode the screenshot once, in a worker thread, while Pass 1 runs;
+        # every per-step crop and the final debug overlay reuse this image
+        decode_task = asyncio.create_task(asyncio.to_thread(_decode_rgb, screenshot_bytes))
+
+        from app.services.agent import generate_locate_steps
         locate_result = await generate_locate_steps(
             goal=goal,
             raw_screenshot_bytes=screenshot_bytes,
             request_id=request_id,
             search_context=search_context,
+            raw_screenshot_url=screenshot_url,
         )
+        del screenshot_url  # release the multi-MB string before Pass 2
 
         # Save Pass 1 debug
         locate_debug = locate_result.pop("_debug", {})
@@ -1213,167 +1699,8 @@ async def create_plan(
         print(f"[plan] rid={request_id} Pass 1 returned {len(raw_steps)} spatial steps")
 
         # ===== PASS 2: For each step, crop → YOLO → identify exact element =====
-        converted_steps: list[Step] = []
-        img = Image.open(io.BytesIO(screenshot_bytes))
-        actual_w, actual_h = img.size
-
-        for step_data in raw_steps:
-            step_id = step_data.get("id", f"s{len(converted_steps) + 1}")
-            instruction = step_data.get("instruction", "")
-            label = step_data.get("label", "")
-            confidence = step_data.get("confidence", 0.5)
-            advance_type = step_data.get("advance", "click_in_target")
-            box_2d = step_data.get("box_2d", [])
-
-            print(f"[plan] rid={request_id} step={step_id} Pass 1 box_2d={box_2d} label={label!r}")
-
-            # Parse box_2d from Pass 1 (0-1000 scale)
-            if not box_2d or len(box_2d) != 4:
-                print(f"[plan] rid={request_id} step={step_id} invalid box_2d, using center fallback")
-                rx, ry, rw, rh = 0.4, 0.4, 0.2, 0.2
-                converted_steps.append(Step(
-                    id=step_id, instruction=instruction,
-                    targets=[TargetRect(type=TargetType.bbox_norm, x=rx, y=ry, w=rw, h=rh,
-                                        confidence=0.1, label=label)],
-                    advance=Advance(type=_ADVANCE_MAP.get(advance_type, AdvanceType.click_in_target)),
-                ))
-                continue
-
-            ymin, xmin, ymax, xmax = box_2d
-            loc_x = xmin / 1000.0
-            loc_y = ymin / 1000.0
-            loc_w = (xmax - xmin) / 1000.0
-            loc_h = (ymax - ymin) / 1000.0
-
-            # Crop a generous region around the Pass 1 box_2d
-            pad = 0.06  # 6% padding on each side
-            crop_x = max(0.0, loc_x - pad)
-            crop_y = max(0.0, loc_y - pad)
-            crop_w = min(loc_w + pad * 2, 1.0 - crop_x)
-            crop_h = min(loc_h + pad * 2, 1.0 - crop_y)
-
-            # Ensure minimum crop size so YOLO has context
-            min_crop = 0.10
-            if crop_w < min_crop:
-                center = loc_x + loc_w / 2
-                crop_x = max(0.0, center - min_crop / 2)
-                crop_w = min(min_crop, 1.0 - crop_x)
-            if crop_h < min_crop:
-                center = loc_y + loc_h / 2
-                crop_y = max(0.0, center - min_crop / 2)
-                crop_h = min(min_crop, 1.0 - crop_y)
-
-            # Pixel crop
-            left = int(crop_x * actual_w)
-            top = int(crop_y * actual_h)
-            right = int((crop_x + crop_w) * actual_w)
-            bottom = int((crop_y + crop_h) * actual_h)
-            cropped = img.crop((left, top, right, bottom)).convert("RGB")
-            crop_buf = io.BytesIO()
-            cropped.save(crop_buf, format="PNG")
-            raw_crop_bytes = crop_buf.getvalue()
-
-            print(f"[plan] rid={request_id} step={step_id} crop=({crop_x:.3f},{crop_y:.3f},{crop_w:.3f},{crop_h:.3f}) "
-                  f"pixels=({right-left}x{bottom-top})")
-
-            # Run YOLO on the crop — catches all elements at high resolution
-            crop_elements = detect_elements(raw_crop_bytes)
-            crop_elements.sort(key=lambda e: (e.bbox_xyxy[1], e.bbox_xyxy[0]))
-            for i, e in enumerate(crop_elements):
-                e.id = i
-
-            print(f"[plan] rid={request_id} step={step_id} YOLO on crop: {len(crop_elements)} elements")
-
-            if not crop_elements:
-                # No elements found — use Pass 1 raw coordinates
-                print(f"[plan] rid={request_id} step={step_id} no YOLO elements in crop, using Pass 1 coords")
-                rx, ry, rw, rh = loc_x, loc_y, loc_w, loc_h
-            else:
-                # Draw numbered boxes on the crop
-                annotated_crop = draw_numbered_boxes(raw_crop_bytes, crop_elements)
-                crop_ctx = format_elements_context(crop_elements)
-
-                # Save crop debug images
-                dbg.save_image(f"pass2_{step_id}_crop_raw", raw_crop_bytes)
-                dbg.save_image(f"pass2_{step_id}_crop_annotated", annotated_crop,
-                               f"{len(crop_elements)} elements")
-                dbg.save_text(f"pass2_{step_id}_elements", crop_ctx)
-
-                # Ask Gemini to pick the exact element on the zoomed crop
-                identify_result = await generate_identify_element(
-                    instruction=instruction,
-                    label=label,
-                    annotated_crop_bytes=annotated_crop,
-                    raw_crop_bytes=raw_crop_bytes,
-                    elements_context=crop_ctx,
-                    request_id=request_id,
-                )
-
-                # Save Pass 2 debug
-                id_debug = identify_result.pop("_debug", {})
-                if id_debug:
-                    dbg.save_prompt_and_response(
-                        f"pass2_{step_id}_identify",
-                        prompt=id_debug.get("prompt", ""),
-                        response=id_debug.get("raw_response", ""),
-                        model=id_debug.get("model", ""),
-                    )
-
-                picked_id = identify_result.get("element_id")
-                crop_elem_map = {e.id: e for e in crop_elements}
-
-                if picked_id is not None and picked_id in crop_elem_map:
-                    # Map crop-relative bbox back to full-screen coordinates
-                    ce = crop_elem_map[picked_id]
-                    ce_x, ce_y, ce_w, ce_h = ce.bbox_xywh
-                    rx = crop_x + ce_x * crop_w
-                    ry = crop_y + ce_y * crop_h
-                    rw = ce_w * crop_w
-                    rh = ce_h * crop_h
-                    confidence = identify_result.get("confidence", confidence)
-                    print(f"[plan] rid={request_id} step={step_id} Pass 2 picked elem[{picked_id}] "
-                          f"-> full ({rx:.3f},{ry:.3f},{rw:.3f},{rh:.3f}) "
-                          f"reasoning: {identify_result.get('reasoning', '')[:80]}")
-                else:
-                    # Fallback: snap Pass 1 box_2d to nearest YOLO crop element
-                    rel_x = (loc_x - crop_x) / crop_w
-                    rel_y = (loc_y - crop_y) / crop_h
-                    rel_w = loc_w / crop_w
-                    rel_h = loc_h / crop_h
-                    snap_x, snap_y, snap_w, snap_h, snap_id = snap_to_nearest_element(
-                        rel_x, rel_y, rel_w, rel_h, crop_elements
-                    )
-                    rx = crop_x + snap_x * crop_w
-                    ry = crop_y + snap_y * crop_h
-                    rw = snap_w * crop_w
-                    rh = snap_h * crop_h
-                    print(f"[plan] rid={request_id} step={step_id} Pass 2 no valid pick, "
-                          f"snapped to elem[{snap_id}] -> full ({rx:.3f},{ry:.3f},{rw:.3f},{rh:.3f})")
-
-            # Clamp
-            rx = max(0.0, min(rx, 1.0))
-            ry = max(0.0, min(ry, 1.0))
-            rw = max(0.02, min(rw, 1.0 - rx))
-            rh = max(0.02, min(rh, 1.0 - ry))
-
-            # Save per-step resolution trace
-            dbg.save_step_resolution(
-                step_id=step_id,
-                step_data=step_data,
-                resolved_bbox=(rx, ry, rw, rh),
-            )
-
-            converted_steps.append(Step(
-                id=step_id,
-                instruction=instruction,
-                targets=[TargetRect(
-                    type=TargetType.bbox_norm,
-                    x=rx, y=ry, w=rw, h=rh,
-                    confidence=confidence,
-                    label=label,
-                )],
-                advance=Advance(type=_ADVANCE_MAP.get(advance_type, AdvanceType.click_in_target)),
-            ))
+        img = await decode_task
+        converted_steps = await _resolve_steps_two_pass(raw_steps, img, dbg, request_id, tag="plan")
 
         plan = StepPlan(
             version="v1",
@@ -1383,8 +1710,11 @@ async def create_plan(
         )
 
         # ===== FINAL: draw final bbox on original screenshot =====
-        _save_bbox_debug(screenshot_bytes, plan,
-                         lambda d: dbg.save_image("FINAL_overlay", d), color=(0, 220, 50))
+        if dbg.enabled:
+            await asyncio.to_thread(
+                _save_bbox_debug, img, plan,
+                lambda d: dbg.save_image("FINAL_overlay", d), color=(0, 220, 50),
+            )
 
         for step in plan.steps:
             for t in step.targets:
@@ -1427,7 +1757,8 @@ async def create_plan_stream(
     """
     Streaming version of /plan. Returns newline-delimited JSON (NDJSON):
       Line 1: {"type":"instruction","text":"Click on..."} — as soon as instruction is available
-      Line 2: {"type":"plan","data":{...full StepPlan...}} — when complete
+      Then:   {"type":"step","step":{...Step...}} — one per step, as soon as it is resolved
+      Last:   {"type":"plan","data":{...full StepPlan...}} — when complete
 
     If session_id is provided (from /start), uses cached YOLO results — skips detection.
     Web search runs concurrently to enrich the LLM prompt with relevant context.
@@ -1438,7 +1769,7 @@ async def create_plan_stream(
     # Try to use cached session from /start
     cached = _session_cache.pop(session_id, None) if session_id else None
 
-    if cached and time.time() - cached["ts"] < _SESSION_TTL:
+    if cached:
         screenshot_bytes = cached["screenshot_bytes"]
         parsed_size = cached["image_size"]
         prefetched_elements = cached["elements"]
@@ -1457,9 +1788,8 @@ async def create_plan_stream(
         gemini_annotated_file = None
         gemini_raw_file = None
         try:
-            size_dict = json.loads(image_size)
-            parsed_size = ImageSize.model_validate(size_dict)
-        except (json.JSONDecodeError, Exception) as e:
+            parsed_size = ImageSize.model_validate_json(image_size)
+        except ValidationError as e:
             raise HTTPException(status_code=422, detail=f"Invalid image_size JSON: {e}")
         if screenshot is None:
             raise HTTPException(status_code=422, detail="No screenshot and no valid session_id")
@@ -1467,6 +1797,12 @@ async def create_plan_stream(
         if len(screenshot_bytes) == 0:
             raise HTTPException(status_code=422, detail="Screenshot file is empty")
 
+    # No /start session: start YOLO in a worker thread right away so it overlaps
+    # with the web search instead of blocking the event loop inside the stream
+    elements_task = None
+    if prefetched_elements is None:
+        elements_task = asyncio.create_task(asyncio.to_thread(_detect_and_annotate, screenshot_bytes))
+
     # Kick off search concurrently before entering the event stream
     search_task = None
     if not skip_search:
@@ -1491,14 +1827,10 @@ async def create_plan_stream(
                 annotated_bytes = prefetched_annotated
                 elements_ctx = prefetched_ctx
             else:
-                elements = detect_elements(screenshot_bytes)
-                elements.sort(key=lambda e: (e.bbox_xyxy[1], e.bbox_xyxy[0]))
-                for i, e in enumerate(elements):
-                    e.id = i
-                annotated_bytes = draw_numbered_boxes(screenshot_bytes, elements)
-                elements_ctx = format_elements_context(elements)
+                elements, annotated_bytes, elements_ctx = await elements_task
 
             elem_map = {e.id: e for e in elements}
+            elem_grid = build_element_grid(elements)
 
             # Collect search results if available
             search_context = ""
@@ -1531,21 +1863,9 @@ async def create_plan_stream(
                 )
                 print(f"[plan-stream] rid={request_id} using OpenAI-compat path (fallback)")
 
-            full_result = None
-            async for event in stream_gen:
-                if event["type"] == "instruction":
-                    yield json.dumps({"type": "instruction", "text": event["text"]}) + "\n"
+            converted_steps: list[Step] = []
 
-                elif event["type"] == "plan":
-                    full_result = event["data"]
-
-            if full_result is None:
-                yield json.dumps({"type": "error", "message": "No plan generated"}) + "\n"
-                return
-
-            # Convert Gemini result → StepPlan with YOLO snapping
-            converted_steps = []
-            for step_data in full_result.get("steps", []):
+            def _convert_step(step_data: dict) -> Step:
                 step_id = step_data.get("id", f"s{len(converted_steps) + 1}")
                 instruction = step_data.get("instruction", "")
                 label = step_data.get("label")
@@ -1558,53 +1878,90 @@ async def create_plan_stream(
                     print(f"[plan-stream] rid={request_id} step={step_id} REASONING: {reasoning}")
                 print(f"[plan-stream] rid={request_id} step={step_id} element_id={step_data.get('element_id')} box_2d={step_data.get('box_2d')} label={label!r}")
 
-                rx, ry, rw, rh = _resolve_bbox(step_data, elements, request_id, "plan-stream")
+                rx, ry, rw, rh, _trust = _resolve_bbox(
+                    step_data, elements, request_id, "plan-stream", grid=elem_grid, elem_map=elem_map
+                )
 
-                converted_steps.append(Step(
+                return Step(
                     id=step_id,
                     instruction=instruction,
-                    targets=[TargetRect(type=TargetType.bbox_norm, x=rx, y=ry, w=rw, h=rh, confidence=confidence, label=label)],
-                    advance=Advance(type=_ADVANCE_MAP.get(advance_type, AdvanceType.click_in_target)),
-                ))
+                    targets=[_bbox_target(rx, ry, rw, rh, confidence, label)],
+                    advance=_advance(advance_type),
+                )
+
+            # Steps are resolved (YOLO snapping) and emitted as soon as each
+            # step object closes in the model output, not after the whole plan
+            full_result = None
+            retried = False
+            async for event in stream_gen:
+                if event["type"] == "instruction":
+                    yield orjson.dumps({"type": "instruction", "text": event["text"]}) + b"\n"
+
+                elif event["type"] == "step":
+                    step = _convert_step(event["data"])
+                    converted_steps.append(step)
+                    yield orjson.dumps({"type": "step", "step": step.model_dump()}) + b"\n"
+
+                elif event["type"] == "plan":
+                    full_result = event["data"]
+                    retried = event.get("retried", False)
+
+            if full_result is None and not converted_steps:
+                yield orjson.dumps({"type": "error", "message": "No plan generated"}) + b"\n"
+                return
+
+            # A retried plan is a different generation than the steps streamed so
+            # far, so its step list replaces them wholesale; otherwise only what
+            # the incremental scanner missed is converted here
+            if retried:
+                print(f"[plan-stream] rid={request_id} stream fell back to a retry, "
+                      f"discarding {len(converted_steps)} streamed steps")
+                converted_steps.clear()
+            if full_result is not None:
+                for step_data in full_result.get("steps", [])[len(converted_steps):]:
+                    converted_steps.append(_convert_step(step_data))
 
             plan = StepPlan(version="v1", goal=goal, image_size=parsed_size, steps=converted_steps)
             plan_json = plan.model_dump()
-            yield json.dumps({"type": "plan", "data": plan_json}) + "\n"
+            yield orjson.dumps({"type": "plan", "data": plan_json}) + b"\n"
 
             print(f"[plan-stream] rid={request_id} done, {len(plan.steps)} steps")
 
         except Exception as e:
             import traceback
             traceback.print_exc()
-            yield json.dumps({"type": "error", "message": str(e)}) + "\n"
+            yield orjson.dumps({"type": "error", "message": str(e)}) + b"\n"
 
     return StreamingResponse(event_stream(), media_type="application/x-ndjson")
 
 
 def _save_bbox_debug(
-    screenshot_bytes: bytes,
+    screenshot: bytes | Image.Image,
     plan: StepPlan,
     save_fn,
     color: tuple[int, int, int] = (0, 200, 50),
 ) -> None:
-    """Draw all target bounding boxes on the original screenshot and pass bytes to save_fn."""
+    """
+    Draw all target bounding boxes on the original screenshot and pass bytes to save_fn.
+    Accepts an already-decoded image (drawn on a copy) or raw bytes.
+    """
     try:
-        img = Image.open(io.BytesIO(screenshot_bytes)).convert("RGB")
+        if isinstance(screenshot, Image.Image):
+            img = screenshot.convert("RGB") if screenshot.mode != "RGB" else screenshot.copy()
+        else:
+            img = _decode_rgb(screenshot)
         actual_w, actual_h = img.size
         draw = ImageDraw.Draw(img)
 
         font_size = max(18, actual_w // 90)
         border_width = max(3, actual_w // 400)
 
-        try:
-            font = ImageFont.truetype("/System/Library/Fonts/Helvetica.ttc", font_size)
-        except Exception:
-            font = ImageFont.load_default()
+        font = get_label_font(font_size)
 
         for step_idx, step in enumerate(plan.steps):
             for t in step.targets:
-                if t.x is None or t.y is None or t.w is None or t.h is None:
-                    continue
+                if not isinstance(t, TargetRectBBox):
+                    continue  # marker targets have no box to draw
                 x1 = int(t.x * actual_w)
                 y1 = int(t.y * actual_h)
                 x2 = int((t.x + t.w) * actual_w)
@@ -1621,8 +1978,6 @@ def _save_bbox_debug(
                 draw.rectangle([lx, ly, lx + lw, ly + lh], fill=color)
                 draw.text((lx + 6, ly + 4), label, fill=(255, 255, 255), font=font)
 
-        buf = io.BytesIO()
-        img.save(buf, format="PNG")
-        save_fn(buf.getvalue())
+        save_fn(_encode_png(img))
     except Exception as e:
         print(f"[plan] _save_bbox_debug failed: {e}")
@@ -5,12 +5,13 @@
 # Receives a crop image + context, returns a tight bounding box
 # in crop-normalized coordinates for the target UI element.
 
-import json
 import os
 
 from fastapi import APIRouter, File, Form, HTTPException, Request, UploadFile
+from pydantic import ValidationError
 
-from app.schemas.step_plan import CropRect, RefineResponse, TargetRect, TargetType
+from app.routers.plan import _clamp_bbox
+from app.schemas.step_plan import CropRect, RefineResponse, TargetRect, TargetRectBBox, TargetType
 from app.services.agent import AgentError, generate_refine
 
 router = APIRouter()
@@ -26,12 +27,9 @@ def _stitch_back(crop_bbox: RefineResponse, crop_rect: CropRect) -> TargetRect:
     h = crop_bbox.h * crop_rect.ch
 
     # Clamp to [0, 1]
-    x = max(0.0, min(x, 1.0))
-    y = max(0.0, min(y, 1.0))
-    w = max(0.001, min(w, 1.0 - x))
-    h = max(0.001, min(h, 1.0 - y))
+    x, y, w, h = _clamp_bbox((x, y), (w, h), min_size=0.001)
 
-    return TargetRect(
+    return TargetRectBBox(
         type=TargetType.bbox_norm,
         x=x,
         y=y,
@@ -65,16 +63,15 @@ async def refine_target(
 
     # --- Parse crop_rect ---
     try:
-        crop_dict = json.loads(crop_rect)
-        parsed_crop = CropRect.model_validate(crop_dict)
-    except (json.JSONDecodeError, Exception) as e:
+        parsed_crop = CropRect.model_validate_json(crop_rect)
+    except ValidationError as e:
         raise HTTPException(status_code=422, detail=f"Invalid crop_rect JSON: {e}")
 
     # --- Mock mode ---
     mock_mode = os.getenv("MOCK_MODE", "false").lower() == "true"
     if mock_mode:
         # Return center of crop as the target
-        return TargetRect(
+        return TargetRectBBox(
             type=TargetType.bbox_norm,
             x=parsed_crop.cx + 0.3 * parsed_crop.cw,
             y=parsed_crop.cy + 0.3 * parsed_crop.ch,
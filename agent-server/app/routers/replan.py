@@ -5,10 +5,10 @@
 # Called when the user is stuck on a step (e.g., 3+ click misses).
 # Takes a fresh screenshot and produces a revised plan.
 
-import json
 import os
 
 from fastapi import APIRouter, File, Form, HTTPException, Request, UploadFile
+from pydantic import ValidationError
 
 from app.schemas.step_plan import ImageSize, StepPlan
 from app.services.agent import AgentError, generate_replan
@@ -16,6 +16,8 @@ from app.services.mock import get_mock_plan
 
 router = APIRouter()
 
+MAX_SCREENSHOT_BYTES = 20 * 1024 * 1024  # 20 MB
+
 
 @router.post("/replan", response_model=StepPlan)
 async def create_replan(
@@ -44,9 +46,8 @@ async def create_replan(
 
     # --- Parse image_size ---
     try:
-        size_dict = json.loads(image_size)
-        parsed_size = ImageSize.model_validate(size_dict)
-    except (json.JSONDecodeError, Exception) as e:
+        parsed_size = ImageSize.model_validate_json(image_size)
+    except ValidationError as e:
         raise HTTPException(status_code=422, detail=f"Invalid image_size JSON: {e}")
 
     # --- Mock mode ---
@@ -56,9 +57,18 @@ async def create_replan(
         return get_mock_plan(goal, parsed_size)
 
     # --- Read screenshot ---
+    # The multipart parser has already spooled the upload and recorded its size,
+    # so oversized uploads are rejected before being pulled into memory.
+    if screenshot.size is not None and screenshot.size > MAX_SCREENSHOT_BYTES:
+        raise HTTPException(status_code=413, detail="Screenshot exceeds 20 MB limit")
     screenshot_bytes = await screenshot.read()
+    # Release the spooled upload now rather than after the response, so the
+    # agent call below doesn't hold a second copy of the screenshot
+    await screenshot.close()
     if len(screenshot_bytes) == 0:
         raise HTTPException(status_code=422, detail="Screenshot file is empty")
+    if len(screenshot_bytes) > MAX_SCREENSHOT_BYTES:
+        raise HTTPException(status_code=413, detail="Screenshot exceeds 20 MB limit")
 
     # --- Generate revised plan ---
     try:
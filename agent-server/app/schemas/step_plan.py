@@ -6,9 +6,9 @@
 # Keep in sync with the JSON schema and Swift Codable models.
 
 from enum import Enum
-from typing import Optional
+from typing import Annotated, Literal, Optional, Union
 
-from pydantic import BaseModel, Field, model_validator
+from pydantic import BaseModel, ConfigDict, Field, model_validator
 
 
 # ---------------------------------------------------------------------------
@@ -45,38 +45,45 @@ class ImageSize(BaseModel):
     w: int = Field(..., ge=1)
     h: int = Field(..., ge=1)
 
-    model_config = {"extra": "forbid"}
+    model_config = ConfigDict(extra="forbid", frozen=True)
 
 
-class TargetRect(BaseModel):
-    """A target represented either by a SoM marker id or normalized bbox."""
+class TargetRectMarker(BaseModel):
+    """A target identified by a SoM marker id."""
 
-    type: TargetType
-    marker_id: Optional[int] = Field(None, ge=0, description="Marker id when type=som_marker")
-    x: Optional[float] = Field(None, ge=0.0, le=1.0, description="Normalized x (top-left origin)")
-    y: Optional[float] = Field(None, ge=0.0, le=1.0, description="Normalized y (top-left origin)")
-    w: Optional[float] = Field(None, gt=0.0, le=1.0, description="Normalized width")
-    h: Optional[float] = Field(None, gt=0.0, le=1.0, description="Normalized height")
+    type: Literal[TargetType.som_marker]
+    marker_id: int = Field(..., ge=0, description="Marker id on the annotated screenshot")
     confidence: Optional[float] = Field(None, ge=0.0, le=1.0)
     label: Optional[str] = None
 
-    model_config = {"extra": "forbid"}
+    model_config = ConfigDict(extra="forbid", frozen=True)
 
-    @model_validator(mode="after")
-    def validate_target_shape(self) -> "TargetRect":
-        if self.type == TargetType.som_marker:
-            if self.marker_id is None:
-                raise ValueError("marker_id is required when type='som_marker'")
-            return self
 
-        if None in (self.x, self.y, self.w, self.h):
-            raise ValueError("x, y, w, h are required when type='bbox_norm'")
+class TargetRectBBox(BaseModel):
+    """A target given as a normalized bbox (top-left origin)."""
+
+    type: Literal[TargetType.bbox_norm]
+    x: float = Field(..., ge=0.0, le=1.0, description="Normalized x (top-left origin)")
+    y: float = Field(..., ge=0.0, le=1.0, description="Normalized y (top-left origin)")
+    w: float = Field(..., gt=0.0, le=1.0, description="Normalized width")
+    h: float = Field(..., gt=0.0, le=1.0, description="Normalized height")
+    confidence: Optional[float] = Field(None, ge=0.0, le=1.0)
+    label: Optional[str] = None
+
+    model_config = ConfigDict(extra="forbid", frozen=True)
 
+    @model_validator(mode="after")
+    def validate_bounds(self) -> "TargetRectBBox":
         if self.x + self.w > 1.0 or self.y + self.h > 1.0:
             raise ValueError("bbox_norm rect must satisfy x+w<=1 and y+h<=1")
         return self
 
 
+# Tagged on "type" so pydantic-core dispatches to the right shape natively
+# (mirrors the oneOf in shared/step_plan_schema.json).
+TargetRect = Annotated[Union[TargetRectMarker, TargetRectBBox], Field(discriminator="type")]
+
+
 class BBoxNorm(BaseModel):
     """Normalized bbox using top-left origin in [0,1]."""
 
@@ -87,7 +94,7 @@ class BBoxNorm(BaseModel):
     confidence: Optional[float] = Field(None, ge=0.0, le=1.0)
     label: Optional[str] = None
 
-    model_config = {"extra": "forbid"}
+    model_config = ConfigDict(extra="forbid", frozen=True)
 
     @model_validator(mode="after")
     def validate_bounds(self) -> "BBoxNorm":
@@ -104,7 +111,7 @@ class CropRectNorm(BaseModel):
     cw: float = Field(..., gt=0.0, le=1.0)
     ch: float = Field(..., gt=0.0, le=1.0)
 
-    model_config = {"extra": "forbid"}
+    model_config = ConfigDict(extra="forbid", frozen=True)
 
     @model_validator(mode="after")
     def validate_bounds(self) -> "CropRectNorm":
@@ -119,7 +126,7 @@ class Advance(BaseModel):
     type: AdvanceType
     notes: Optional[str] = None
 
-    model_config = {"extra": "forbid"}
+    model_config = ConfigDict(extra="forbid", frozen=True)
 
 
 class Safety(BaseModel):
@@ -128,7 +135,7 @@ class Safety(BaseModel):
     requires_confirmation: Optional[bool] = None
     risk_level: Optional[RiskLevel] = None
 
-    model_config = {"extra": "forbid"}
+    model_config = ConfigDict(extra="forbid", frozen=True)
 
 
 class AppContext(BaseModel):
@@ -138,7 +145,7 @@ class AppContext(BaseModel):
     bundle_id: Optional[str] = None
     window_title: Optional[str] = None
 
-    model_config = {"extra": "forbid"}
+    model_config = ConfigDict(extra="forbid", frozen=True)
 
 
 # ---------------------------------------------------------------------------
@@ -154,7 +161,7 @@ class SoMMarker(BaseModel):
     cy: float = Field(..., ge=0.0, le=1.0, description="Normalized center y")
     radius: float = Field(..., gt=0.0, le=1.0, description="Normalized marker radius")
 
-    model_config = {"extra": "forbid"}
+    model_config = ConfigDict(extra="forbid", frozen=True)
 
 
 class SoMTarget(BaseModel):
@@ -164,7 +171,7 @@ class SoMTarget(BaseModel):
     confidence: Optional[float] = Field(None, ge=0.0, le=1.0)
     label: Optional[str] = None
 
-    model_config = {"extra": "forbid"}
+    model_config = ConfigDict(extra="forbid", frozen=True)
 
 
 class CropRect(BaseModel):
@@ -175,7 +182,7 @@ class CropRect(BaseModel):
     cw: float = Field(..., gt=0.0, le=1.0, description="Crop width")
     ch: float = Field(..., gt=0.0, le=1.0, description="Crop height")
 
-    model_config = {"extra": "forbid"}
+    model_config = ConfigDict(extra="forbid", frozen=True)
 
 
 class RefineResponse(BaseModel):
@@ -188,7 +195,7 @@ class RefineResponse(BaseModel):
     confidence: Optional[float] = Field(None, ge=0.0, le=1.0)
     label: Optional[str] = None
 
-    model_config = {"extra": "forbid"}
+    model_config = ConfigDict(extra="forbid", frozen=True)
 
 
 class SoMStep(BaseModel):
@@ -200,7 +207,7 @@ class SoMStep(BaseModel):
     advance: Advance
     safety: Optional[Safety] = None
 
-    model_config = {"extra": "forbid"}
+    model_config = ConfigDict(extra="forbid", frozen=True)
 
 
 class SoMStepPlan(BaseModel):
@@ -211,7 +218,7 @@ class SoMStepPlan(BaseModel):
     image_size: ImageSize
     steps: list[SoMStep] = Field(..., min_length=1, max_length=10)
 
-    model_config = {"extra": "forbid"}
+    model_config = ConfigDict(extra="forbid", frozen=True)
 
 
 # ---------------------------------------------------------------------------
@@ -229,7 +236,7 @@ class OmniPlanStep(BaseModel):
     advance: Advance
     safety: Optional[Safety] = None
 
-    model_config = {"extra": "forbid"}
+    model_config = ConfigDict(extra="forbid", frozen=True)
 
 
 class OmniPlanResponse(BaseModel):
@@ -240,7 +247,7 @@ class OmniPlanResponse(BaseModel):
     image_size: ImageSize
     steps: list[OmniPlanStep] = Field(..., min_length=1, max_length=10)
 
-    model_config = {"extra": "forbid"}
+    model_config = ConfigDict(extra="forbid", frozen=True)
 
 
 # ---------------------------------------------------------------------------
@@ -257,7 +264,7 @@ class Step(BaseModel):
     advance: Advance
     safety: Optional[Safety] = None
 
-    model_config = {"extra": "forbid"}
+    model_config = ConfigDict(extra="forbid", frozen=True)
 
 
 class StepPlan(BaseModel):
@@ -272,7 +279,7 @@ class StepPlan(BaseModel):
     image_size: ImageSize
     steps: list[Step] = Field(..., min_length=1, max_length=10)
 
-    model_config = {"extra": "forbid"}
+    model_config = ConfigDict(extra="forbid", frozen=True)
 
 
 class NextStepResponse(BaseModel):
@@ -293,4 +300,4 @@ class NextStepResponse(BaseModel):
     image_size: ImageSize
     steps: list[Step] = Field(default_factory=list, max_length=10)
 
-    model_config = {"extra": "forbid"}
+    model_config = ConfigDict(extra="forbid", frozen=True)
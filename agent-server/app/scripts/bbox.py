@@ -16,56 +16,82 @@ SCALE = 0.5       # Resize factor for faster processing
 MIN_AREA = 500    # Minimum contour area (filters tiny noise)
 
 
-def detect_boxes_fast(image_path: str) -> tuple:
-    """
-    Detect bounding boxes in a screenshot using Canny edge detection.
-    Returns (annotated_image, boxes) where boxes is a list of (x, y, w, h).
-    """
-    original = cv2.imread(image_path)
+def _load_bgr(image: str | bytes | np.ndarray) -> np.ndarray:
+    """Return a BGR array for a file path, encoded image bytes, or an array."""
+    if isinstance(image, np.ndarray):
+        return image
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        original = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR)
+        if original is None:
+            raise ValueError("Could not decode image bytes")
+        return original
+    original = cv2.imread(image)
     if original is None:
-        raise ValueError(f"Could not load image at path: {image_path}")
+        raise ValueError(f"Could not load image at path: {image}")
+    return original
+
 
+def _find_boxes(original: np.ndarray) -> np.ndarray:
+    """Return an (N, 4) int32 array of (x, y, w, h) at original resolution."""
     orig_h, orig_w = original.shape[:2]
 
-    # Resize down for speed
-    small = cv2.resize(
-        original,
-        (int(orig_w * SCALE), int(orig_h * SCALE)),
-        interpolation=cv2.INTER_AREA,
-    )
+    # Convert to gray at full size first so the downscale only touches one
+    # channel instead of three
+    gray = cv2.cvtColor(original, cv2.COLOR_BGR2GRAY)
 
-    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    # Resize down for speed (pyrDown is the dedicated, faster path for 2x)
+    if SCALE == 0.5:
+        gray = cv2.pyrDown(gray)
+    else:
+        gray = cv2.resize(
+            gray,
+            (int(orig_w * SCALE), int(orig_h * SCALE)),
+            interpolation=cv2.INTER_AREA,
+        )
 
     # Fast edge detection
     edges = cv2.Canny(gray, 50, 150)
+    del gray
+
+    # Each connected run of edge pixels is one candidate outline; OpenCV
+    # returns every component's bbox in a single stats array (row 0 is the
+    # background). Edge components are thin, so filter on bbox area rather
+    # than pixel count.
+    _, labels, stats, _ = cv2.connectedComponentsWithStats(edges, connectivity=8)
+    del labels, edges
+    rects = stats[1:, [cv2.CC_STAT_LEFT, cv2.CC_STAT_TOP, cv2.CC_STAT_WIDTH, cv2.CC_STAT_HEIGHT]]
+    rects = rects[rects[:, 2] * rects[:, 3] >= MIN_AREA]
 
-    contours, _ = cv2.findContours(
-        edges,
-        cv2.RETR_TREE,
-        cv2.CHAIN_APPROX_SIMPLE,
-    )
+    # Scale boxes back up to original resolution
+    return (rects / SCALE).astype(np.int32)
 
-    boxes = []
-    for cnt in contours:
-        area = cv2.contourArea(cnt)
-        if area < MIN_AREA:
-            continue
 
-        x, y, w, h = cv2.boundingRect(cnt)
+def detect_boxes_only(image: str | bytes | np.ndarray) -> list:
+    """
+    Detect bounding boxes without drawing them. Nothing but the box list is
+    kept, so prefer this when the annotated image isn't needed.
+    Returns a list of (x, y, w, h).
+    """
+    return [tuple(r) for r in _find_boxes(_load_bgr(image)).tolist()]
 
-        # Scale box back up to original resolution
-        x = int(x / SCALE)
-        y = int(y / SCALE)
-        w = int(w / SCALE)
-        h = int(h / SCALE)
 
-        boxes.append((x, y, w, h))
+def detect_boxes_fast(image: str | bytes | np.ndarray) -> tuple:
+    """
+    Detect bounding boxes in a screenshot using Canny edge detection.
+    `image` may be a file path, encoded image bytes, or a decoded BGR array
+    (which is copied, not drawn on).
+    Returns (annotated_image, boxes) where boxes is a list of (x, y, w, h).
+    """
+    original = _load_bgr(image)
+    if original is image:
+        original = original.copy()
+    rects = _find_boxes(original).tolist()
 
     # Draw on original image
-    for (x, y, w, h) in boxes:
+    for x, y, w, h in rects:
         cv2.rectangle(original, (x, y), (x + w, y + h), (0, 255, 0), 2)
 
-    return original, boxes
+    return original, [tuple(r) for r in rects]
 
 
 def main():
@@ -7,13 +7,15 @@
 
 import asyncio
 import base64
-import json
+import hashlib
 import os
 import re
 import tempfile
 import time
 from pathlib import Path
 
+import orjson
+from cachetools import TTLCache
 from openai import AsyncOpenAI
 
 # Native Gemini SDK — used for file upload + pre-cached image generation.
@@ -38,6 +40,9 @@ from app.schemas.step_plan import (
 # ---------------------------------------------------------------------------
 # Prompt templates
 # ---------------------------------------------------------------------------
+# Templates keep their static instructions and JSON schema first and the
+# {{PLACEHOLDER}} inputs in a trailing block, so consecutive calls share an
+# identical prefix the provider's automatic prompt cache can reuse.
 _PROMPT_PATH = Path(__file__).parent.parent / "prompts" / "plan_prompt.txt"
 _PROMPT_TEMPLATE = _PROMPT_PATH.read_text()
 _REFINE_PROMPT_PATH = Path(__file__).parent.parent / "prompts" / "refine_prompt.txt"
@@ -77,6 +82,14 @@ _LOCATE_NEXT_PROMPT_TEMPLATE = _LOCATE_NEXT_PROMPT_PATH.read_text()
 _IDENTIFY_PROMPT_PATH = Path(__file__).parent.parent / "prompts" / "gemini_identify_prompt.txt"
 _IDENTIFY_PROMPT_TEMPLATE = _IDENTIFY_PROMPT_PATH.read_text()
 
+_PLACEHOLDER_RE = re.compile(r"\{\{([A-Z0-9_]+)\}\}")
+
+
+def _fill_prompt(template: str, **values: str) -> str:
+    """Substitute {{NAME}} placeholders in a single pass; unknown names are left as-is."""
+    return _PLACEHOLDER_RE.sub(lambda m: values.get(m.group(1), m.group(0)), template)
+
+
 # ---------------------------------------------------------------------------
 # LLM client (lazy singleton) — supports Gemini, OpenAI, and OpenRouter
 # ---------------------------------------------------------------------------
@@ -137,6 +150,19 @@ class AgentError(Exception):
     pass
 
 
+# ---------------------------------------------------------------------------
+# Image data URLs
+# ---------------------------------------------------------------------------
+def _image_data_url(image_bytes: bytes) -> str:
+    """
+    Base64 data URL for PNG or JPEG bytes (mime sniffed from the magic bytes).
+    Callers that send one screenshot to several calls build this once and
+    pass it down, rather than re-encoding the multi-MB payload per call.
+    """
+    mime = "image/jpeg" if image_bytes[:3] == b"\xff\xd8\xff" else "image/png"
+    return f"data:{mime};base64,{base64.b64encode(image_bytes).decode('ascii')}"
+
+
 # ---------------------------------------------------------------------------
 # JSON extraction (robust — handles fences, truncation, partial output)
 # ---------------------------------------------------------------------------
@@ -211,17 +237,20 @@ def _extract_json(raw: str) -> dict:
     raw = raw.strip()
 
     # --- Strategy 1: Direct parse (best case) ---
-    try:
-        return json.loads(raw)
-    except json.JSONDecodeError:
-        pass
+    # Only worth trying on bare JSON; a fenced or prefixed response would just
+    # build and throw away a JSONDecodeError here.
+    if raw.startswith(("{", "[")):
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass
 
     # --- Strategy 2: Code fence extraction ---
-    match = _CODE_FENCE_RE.search(raw)
+    match = _CODE_FENCE_RE.search(raw) if "```" in raw else None
     if match:
         try:
-            return json.loads(match.group(1).strip())
-        except json.JSONDecodeError:
+            return orjson.loads(match.group(1).strip())
+        except orjson.JSONDecodeError:
             pass
 
     # --- Strategy 3: First { ... } block ---
@@ -229,8 +258,8 @@ def _extract_json(raw: str) -> dict:
     brace_end = raw.rfind("}")
     if brace_start != -1 and brace_end > brace_start:
         try:
-            return json.loads(raw[brace_start : brace_end + 1])
-        except json.JSONDecodeError:
+            return orjson.loads(raw[brace_start : brace_end + 1])
+        except orjson.JSONDecodeError:
             pass
 
     # --- Strategy 4: Repair truncated JSON ---
@@ -244,20 +273,88 @@ def _extract_json(raw: str) -> dict:
         repaired = _repair_truncated_json(fragment)
         if repaired:
             try:
-                result = json.loads(repaired)
+                result = orjson.loads(repaired)
                 print(f"[agent] _extract_json REPAIRED truncated JSON ({len(raw)} -> {len(repaired)} chars)")
                 if isinstance(result, dict):
                     return result
                 # If it parsed to a list, wrap it
                 if isinstance(result, list):
                     return {"steps": result}
-            except json.JSONDecodeError:
+            except orjson.JSONDecodeError:
                 pass
 
     print(f"[agent] _extract_json FAILED — raw content: {raw[:500]!r}")
     raise AgentError(f"Could not extract valid JSON from model response (length={len(raw)})")
 
 
+_STEPS_ARRAY_RE = re.compile(r'"steps"\s*:\s*\[')
+
+
+class _StepStreamScanner:
+    """
+    Incremental scanner over a streamed plan response.
+    Finds the "steps" array and returns each step object as soon as its
+    closing brace arrives, so callers can act on step 1 while the model
+    is still writing step 2. Bracket-balanced and string/escape aware.
+    """
+
+    def __init__(self) -> None:
+        self._buf = ""
+        self._pos = -1          # scan position; -1 until the steps array is found
+        self._depth = 0
+        self._in_string = False
+        self._escape_next = False
+        self._obj_start = -1
+        self._done = False
+
+    def feed(self, text: str) -> list[dict]:
+        """Append streamed text; return any step objects completed by it."""
+        self._buf += text
+        if self._done:
+            return []
+        if self._pos < 0:
+            m = _STEPS_ARRAY_RE.search(self._buf)
+            if not m:
+                return []
+            self._pos = m.end()
+
+        completed: list[dict] = []
+        buf = self._buf
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if self._escape_next:
+                self._escape_next = False
+            elif self._in_string:
+                if ch == '\\':
+                    self._escape_next = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == '{':
+                if self._depth == 0:
+                    self._obj_start = i
+                self._depth += 1
+            elif ch == '}':
+                self._depth -= 1
+                if self._depth == 0 and self._obj_start >= 0:
+                    try:
+                        step = orjson.loads(buf[self._obj_start : i + 1])
+                        if isinstance(step, dict):
+                            completed.append(step)
+                    except orjson.JSONDecodeError:
+                        pass
+                    self._obj_start = -1
+            elif ch == ']' and self._depth == 0:
+                self._done = True
+                i += 1
+                break
+            i += 1
+        self._pos = i
+        return completed
+
+
 # ---------------------------------------------------------------------------
 # Model-adaptive parameters
 # ---------------------------------------------------------------------------
@@ -304,8 +401,157 @@ def _supports_json_mode(model: str) -> bool:
 # ---------------------------------------------------------------------------
 MAX_RETRIES = 2  # retry twice (for rate limits + invalid JSON)
 
-# Global semaphore to serialize LLM calls and avoid piling up rate-limited requests
-_llm_semaphore = asyncio.Semaphore(1)
+# Per-model admission control: calls run concurrently and only wait when the
+# model's requests-per-minute or tokens-per-minute budget would be exceeded.
+# Tunable via LLM_RPM / LLM_TPM to match the provider's quota.
+_LLM_RPM = max(1, int(os.getenv("LLM_RPM", "60")))
+_LLM_TPM = max(1, int(os.getenv("LLM_TPM", "1000000")))
+_IMAGE_B64_CHARS_PER_TOKEN = 700  # rough image-token heuristic on the base64 payload
+
+
+class _TokenBucket:
+    """Continuously refilling bucket holding at most `per_minute` units."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        amount = min(amount, self.capacity)  # oversized requests just drain the bucket
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)
+
+
+class _ModelRateLimiter:
+    """Request + token buckets for one model; waiters are admitted in FIFO order."""
+
+    def __init__(self, rpm: int, tpm: int):
+        self.requests = _TokenBucket(rpm)
+        self.tokens = _TokenBucket(tpm)
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+                if wait <= 0:
+                    self.requests.take(1)
+                    self.tokens.take(tokens)
+                    return
+                await asyncio.sleep(wait)
+
+
+_rate_limiters: dict[str, _ModelRateLimiter] = {}
+
+
+def _get_rate_limiter(model: str) -> _ModelRateLimiter:
+    limiter = _rate_limiters.get(model)
+    if limiter is None:
+        limiter = _rate_limiters[model] = _ModelRateLimiter(_LLM_RPM, _LLM_TPM)
+    return limiter
+
+
+def _estimate_tokens(messages: list) -> int:
+    """Cheap input-token estimate: ~4 chars per text token plus an image heuristic."""
+    total = 0
+    for msg in messages:
+        content = msg.get("content")
+        if isinstance(content, str):
+            total += len(content) // 4
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                total += len(part["text"]) // 4
+            elif part.get("type") == "image_url":
+                total += len(part["image_url"]["url"]) // _IMAGE_B64_CHARS_PER_TOKEN
+    return max(1, total)
+
+
+# ---------------------------------------------------------------------------
+# Response cache (exact match, opt-in via AGENT_CACHE=true)
+# ---------------------------------------------------------------------------
+# Retrying a step on an unchanged screen sends byte-identical messages, so the
+# model's previous answer can be replayed instead of paying for another call.
+_RESPONSE_CACHE_MAX = 128
+_RESPONSE_CACHE_TTL = 30 * 60  # 30 minutes
+_response_cache: TTLCache = TTLCache(maxsize=_RESPONSE_CACHE_MAX, ttl=_RESPONSE_CACHE_TTL)
+
+
+def _request_key(model: str, messages: list, params: dict) -> str:
+    """Hash of everything sent to the model."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(model.encode())
+    h.update(orjson.dumps(params, option=orjson.OPT_SORT_KEYS))
+    h.update(orjson.dumps(messages))  # includes the screenshot data URLs
+    return h.hexdigest()
+
+
+def _response_cache_key(model: str, messages: list, params: dict) -> str | None:
+    """Request key for the response cache, or None when AGENT_CACHE is off."""
+    if os.getenv("AGENT_CACHE", "false").lower() != "true":
+        return None
+    return _request_key(model, messages, params)
+
+
+def _remember_response(cache_key: str | None, raw_text: str) -> None:
+    if cache_key is not None and raw_text:
+        _response_cache[cache_key] = raw_text
+
+
+# Single-flight: identical requests issued while one is still running (UI
+# double-fires, replan racing /next) await that call instead of starting another.
+# Calls are bucketed by a cheap key (text parts + image *lengths*, so the
+# multi-MB data URLs are never serialized or hashed); a bucket hit is confirmed
+# with a full messages == comparison, which only runs for likely duplicates.
+class _InflightCall:
+    def __init__(self, messages: list, task: asyncio.Task):
+        self.messages = messages
+        self.task = task
+        self.waiters = 0
+
+
+_inflight_calls: dict[str, list[_InflightCall]] = {}
+
+
+def _inflight_key(model: str, messages: list, params: dict) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(model.encode())
+    h.update(orjson.dumps(params, option=orjson.OPT_SORT_KEYS))
+    for msg in messages:
+        h.update(msg["role"].encode())
+        content = msg.get("content")
+        for part in [content] if isinstance(content, str) else content or []:
+            if isinstance(part, str):
+                h.update(part.encode())
+            elif part.get("type") == "image_url":
+                h.update(str(len(part["image_url"]["url"])).encode())
+            else:
+                h.update(part.get("text", "").encode())
+            h.update(b"\0")
+    return h.hexdigest()
+
+
+def _unregister_inflight(key: str, call: _InflightCall) -> None:
+    """Remove the call from its bucket so no new request can join it."""
+    bucket = _inflight_calls.get(key, [])
+    if call in bucket:
+        bucket.remove(call)
+    if not bucket:
+        _inflight_calls.pop(key, None)
+
+
+def _finish_inflight(key: str, call: _InflightCall) -> None:
+    """Done-callback: unregister the call and consume its outcome."""
+    _unregister_inflight(key, call)
+    if not call.task.cancelled():
+        call.task.exception()  # retrieved here so an unwaited failure doesn't warn
 
 
 async def _call_llm_with_backoff(
@@ -315,7 +561,8 @@ async def _call_llm_with_backoff(
 ):
     """
     Call the LLM with rate-limit-aware retry and backoff.
-    Uses a semaphore to avoid piling up concurrent requests.
+    Each attempt is admitted through the model's rate limiter first, and
+    identical concurrent requests share a single call.
     Automatically handles response_format support per model.
 
     If validate_json=True (default), validates the response is parseable JSON.
@@ -327,74 +574,119 @@ async def _call_llm_with_backoff(
     if _supports_json_mode(model):
         extra_kwargs["response_format"] = {"type": "json_object"}
 
-    async with _llm_semaphore:
-        for attempt in range(1 + MAX_RETRIES):
-            try:
-                print(f"[agent] rid={request_id} {label} attempt={attempt + 1} model={model}")
-                response = await client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    **params,
-                    **extra_kwargs,
-                )
-                raw_text = response.choices[0].message.content or ""
-                print(f"[agent] rid={request_id} {label} response length={len(raw_text)}")
+    cache_key = _response_cache_key(model, messages, {**params, **extra_kwargs})
+    if cache_key is not None and cache_key in _response_cache:
+        print(f"[agent] rid={request_id} {label} response cache hit")
+        return _response_cache[cache_key]
 
-                # Validate JSON if requested
-                if validate_json and raw_text:
-                    try:
-                        _extract_json(raw_text)
-                    except AgentError:
-                        # JSON invalid — try a repair retry if we have attempts left
-                        if attempt < MAX_RETRIES:
-                            print(f"[agent] rid={request_id} {label} invalid JSON, "
-                                  f"attempting repair retry with model feedback")
-                            repair_messages = messages + [
-                                {"role": "assistant", "content": raw_text},
-                                {"role": "user", "content": (
-                                    "Your previous response was truncated or contained invalid JSON. "
-                                    "Please output the COMPLETE, valid JSON response. "
-                                    "Output ONLY the JSON, no other text."
-                                )},
-                            ]
-                            try:
-                                repair_response = await client.chat.completions.create(
-                                    model=model,
-                                    messages=repair_messages,
-                                    **params,
-                                    **extra_kwargs,
-                                )
-                                repair_text = repair_response.choices[0].message.content or ""
-                                print(f"[agent] rid={request_id} {label} repair response length={len(repair_text)}")
-                                # Validate the repair
-                                _extract_json(repair_text)
-                                return repair_text
-                            except Exception as repair_err:
-                                print(f"[agent] rid={request_id} {label} repair also failed: {repair_err}")
-                                # Fall through to normal retry
-                                await asyncio.sleep(1)
-                                continue
-                        # No retries left — return raw and let caller deal with it
-                        # (_extract_json's truncation repair may still save it)
-
-                return raw_text
-            except Exception as e:
-                error_str = str(e)
-                if "429" in error_str or "rate_limit" in error_str.lower():
-                    # Extract retry-after if available, default to 25s
-                    wait = 25
-                    import re as _re
-                    match = _re.search(r"try again in (\d+\.?\d*)s", error_str)
-                    if match:
-                        wait = float(match.group(1)) + 2  # add buffer
-                    print(f"[agent] rid={request_id} {label} rate limited, waiting {wait:.0f}s...")
-                    await asyncio.sleep(wait)
-                elif attempt < MAX_RETRIES:
-                    print(f"[agent] rid={request_id} {label} attempt={attempt + 1} error: {e}")
-                    await asyncio.sleep(1)
+    key = _inflight_key(model, messages, {**params, **extra_kwargs})
+    bucket = _inflight_calls.setdefault(key, [])
+    call = next((c for c in bucket if c.messages == messages), None)
+    if call is not None:
+        print(f"[agent] rid={request_id} {label} joining identical in-flight request")
+    else:
+        call = _InflightCall(messages, asyncio.ensure_future(_call_llm_attempts(
+            client, model, messages, params, extra_kwargs,
+            request_id, label, validate_json, cache_key,
+        )))
+        bucket.append(call)
+        call.task.add_done_callback(lambda _: _finish_inflight(key, call))
+
+    # Shielded so one caller being cancelled doesn't cancel the call for the
+    # others; once the last waiter has gone the call itself is cancelled. It is
+    # unregistered first so an identical request arriving before the task has
+    # finished cancelling starts a fresh call instead of joining a dead one.
+    call.waiters += 1
+    try:
+        return await asyncio.shield(call.task)
+    finally:
+        call.waiters -= 1
+        if call.waiters == 0 and not call.task.done():
+            _unregister_inflight(key, call)
+            call.task.cancel()
+
+
+async def _call_llm_attempts(
+    client, model: str, messages: list, params: dict, extra_kwargs: dict,
+    request_id: str, label: str, validate_json: bool, cache_key: str | None,
+) -> str:
+    """Retry loop behind _call_llm_with_backoff (one run per distinct request)."""
+    limiter = _get_rate_limiter(model)
+    est_tokens = _estimate_tokens(messages)
+    for attempt in range(1 + MAX_RETRIES):
+        try:
+            await limiter.acquire(est_tokens)
+            print(f"[agent] rid={request_id} {label} attempt={attempt + 1} model={model}")
+            response = await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                **params,
+                **extra_kwargs,
+            )
+            raw_text = response.choices[0].message.content or ""
+            print(f"[agent] rid={request_id} {label} response length={len(raw_text)}")
+
+            # Validate JSON if requested
+            if validate_json and raw_text:
+                try:
+                    _extract_json(raw_text)
+                except AgentError:
+                    # JSON invalid — try a repair retry if we have attempts left
+                    if attempt < MAX_RETRIES:
+                        print(f"[agent] rid={request_id} {label} invalid JSON, "
+                              f"attempting repair retry with model feedback")
+                        repair_messages = messages + [
+                            {"role": "assistant", "content": raw_text},
+                            {"role": "user", "content": (
+                                "Your previous response was truncated or contained invalid JSON. "
+                                "Please output the COMPLETE, valid JSON response. "
+                                "Output ONLY the JSON, no other text."
+                            )},
+                        ]
+                        try:
+                            await limiter.acquire(_estimate_tokens(repair_messages))
+                            repair_response = await client.chat.completions.create(
+                                model=model,
+                                messages=repair_messages,
+                                **params,
+                                **extra_kwargs,
+                            )
+                            repair_text = repair_response.choices[0].message.content or ""
+                            print(f"[agent] rid={request_id} {label} repair response length={len(repair_text)}")
+                            # Validate the repair
+                            _extract_json(repair_text)
+                            _remember_response(cache_key, repair_text)
+                            return repair_text
+                        except Exception as repair_err:
+                            print(f"[agent] rid={request_id} {label} repair also failed: {repair_err}")
+                            # Fall through to normal retry
+                            await asyncio.sleep(1)
+                            continue
+                    # No retries left — return raw and let caller deal with it
+                    # (_extract_json's truncation repair may still save it)
                 else:
-                    raise
-        raise AgentError(f"{label} failed after {MAX_RETRIES + 1} attempts")
+                    _remember_response(cache_key, raw_text)
+            else:
+                _remember_response(cache_key, raw_text)
+
+            return raw_text
+        except Exception as e:
+            error_str = str(e)
+            if "429" in error_str or "rate_limit" in error_str.lower():
+                # Extract retry-after if available, default to 25s
+                wait = 25
+                import re as _re
+                match = _re.search(r"try again in (\d+\.?\d*)s", error_str)
+                if match:
+                    wait = float(match.group(1)) + 2  # add buffer
+                print(f"[agent] rid={request_id} {label} rate limited, waiting {wait:.0f}s...")
+                await asyncio.sleep(wait)
+            elif attempt < MAX_RETRIES:
+                print(f"[agent] rid={request_id} {label} attempt={attempt + 1} error: {e}")
+                await asyncio.sleep(1)
+            else:
+                raise
+    raise AgentError(f"{label} failed after {MAX_RETRIES + 1} attempts")
 
 
 # ---------------------------------------------------------------------------
@@ -421,17 +713,16 @@ async def generate_plan(
     client = _get_client()
 
     # Build prompt from template
-    image_size_json = json.dumps({"w": image_size.w, "h": image_size.h})
-    prompt = _PROMPT_TEMPLATE
-    prompt = prompt.replace("{{GOAL}}", goal)
-    prompt = prompt.replace("{{IMAGE_SIZE_JSON}}", image_size_json)
-    prompt = prompt.replace("{{LEARNING_PROFILE_TEXT}}", learning_profile or "default")
-    prompt = prompt.replace("{{APP_CONTEXT_JSON}}", app_context or "{}")
-    prompt = prompt.replace("{{SESSION_SUMMARY}}", session_summary or "none")
-    prompt = prompt.replace("{{MARKERS_JSON}}", markers_json)
-
-    # Encode marked screenshot
-    screenshot_b64 = base64.b64encode(screenshot_with_markers_bytes).decode("utf-8")
+    image_size_json = orjson.dumps({"w": image_size.w, "h": image_size.h}).decode()
+    prompt = _fill_prompt(
+        _PROMPT_TEMPLATE,
+        GOAL=goal,
+        IMAGE_SIZE_JSON=image_size_json,
+        LEARNING_PROFILE_TEXT=learning_profile or "default",
+        APP_CONTEXT_JSON=app_context or "{}",
+        SESSION_SUMMARY=session_summary or "none",
+        MARKERS_JSON=markers_json,
+    )
 
     model = os.getenv("OPENAI_MODEL", "gpt-4o")
     messages = [
@@ -442,7 +733,7 @@ async def generate_plan(
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/png;base64,{screenshot_b64}",
+                        "url": _image_data_url(screenshot_with_markers_bytes),
                         "detail": "high",
                     },
                 },
@@ -475,7 +766,7 @@ async def generate_plan(
 
         except AgentError:
             raise  # don't retry config errors
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             last_error = AgentError(f"Invalid JSON from model: {e}")
             print(f"[agent] rid={request_id} attempt={attempt + 1} JSON parse error: {e}")
         except Exception as e:
@@ -497,14 +788,15 @@ async def generate_refined_bbox(
     """Generate a tight bbox in crop-normalized coordinates."""
     client = _get_client()
 
-    prompt = _REFINE_PROMPT_TEMPLATE
-    prompt = prompt.replace("{{GOAL}}", goal)
-    prompt = prompt.replace("{{STEP_ID}}", step_id)
-    prompt = prompt.replace("{{INSTRUCTION}}", instruction)
-    prompt = prompt.replace("{{CROP_RECT_FULL_NORM_JSON}}", crop_rect_full_norm_json)
-    prompt = prompt.replace("{{SESSION_SUMMARY}}", session_summary or "none")
+    prompt = _fill_prompt(
+        _REFINE_PROMPT_TEMPLATE,
+        GOAL=goal,
+        STEP_ID=step_id,
+        INSTRUCTION=instruction,
+        CROP_RECT_FULL_NORM_JSON=crop_rect_full_norm_json,
+        SESSION_SUMMARY=session_summary or "none",
+    )
 
-    crop_b64 = base64.b64encode(crop_image_bytes).decode("utf-8")
     model = os.getenv("OPENAI_MODEL", "gpt-4o")
     messages = [
         {
@@ -514,7 +806,7 @@ async def generate_refined_bbox(
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/png;base64,{crop_b64}",
+                        "url": _image_data_url(crop_image_bytes),
                         "detail": "high",
                     },
                 },
@@ -539,7 +831,7 @@ async def generate_refined_bbox(
             return bbox
         except AgentError:
             raise
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             last_error = AgentError(f"Invalid JSON from model on refine: {e}")
             print(f"[agent] rid={request_id} refine attempt={attempt + 1} JSON error: {e}")
         except Exception as e:
@@ -572,16 +864,16 @@ async def generate_replan(
     """
     client = _get_client()
 
-    image_size_json = json.dumps({"w": image_size.w, "h": image_size.h})
-    prompt = _REPLAN_PROMPT_TEMPLATE
-    prompt = prompt.replace("{{GOAL}}", goal)
-    prompt = prompt.replace("{{IMAGE_SIZE_JSON}}", image_size_json)
-    prompt = prompt.replace("{{CURRENT_STEP_ID}}", current_step_id)
-    prompt = prompt.replace("{{LEARNING_PROFILE_TEXT}}", learning_profile or "default")
-    prompt = prompt.replace("{{APP_CONTEXT_JSON}}", app_context or "{}")
-    prompt = prompt.replace("{{SESSION_SUMMARY}}", session_summary or "none")
-
-    screenshot_b64 = base64.b64encode(screenshot_bytes).decode("utf-8")
+    image_size_json = orjson.dumps({"w": image_size.w, "h": image_size.h}).decode()
+    prompt = _fill_prompt(
+        _REPLAN_PROMPT_TEMPLATE,
+        GOAL=goal,
+        IMAGE_SIZE_JSON=image_size_json,
+        CURRENT_STEP_ID=current_step_id,
+        LEARNING_PROFILE_TEXT=learning_profile or "default",
+        APP_CONTEXT_JSON=app_context or "{}",
+        SESSION_SUMMARY=session_summary or "none",
+    )
 
     model = os.getenv("OPENAI_MODEL", "gpt-4o")
     messages = [
@@ -592,7 +884,7 @@ async def generate_replan(
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/png;base64,{screenshot_b64}",
+                        "url": _image_data_url(screenshot_bytes),
                         "detail": "high",
                     },
                 },
@@ -600,29 +892,34 @@ async def generate_replan(
         }
     ]
 
+    params = {**_model_params(model, 2000), "response_format": {"type": "json_object"}}
+    cache_key = _response_cache_key(model, messages, params)
     last_error: Exception | None = None
 
     for attempt in range(1 + MAX_RETRIES):
         try:
-            print(f"[agent] rid={request_id} replan attempt={attempt + 1} stuck_at={current_step_id}")
-
-            response = await client.chat.completions.create(
-                model=model,
-                messages=messages,
-                **_model_params(model, 2000),
-                response_format={"type": "json_object"},
-            )
+            raw_text = _response_cache.get(cache_key) if cache_key is not None else None
+            if raw_text is not None:
+                print(f"[agent] rid={request_id} replan response cache hit")
+            else:
+                print(f"[agent] rid={request_id} replan attempt={attempt + 1} stuck_at={current_step_id}")
+                response = await client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    **params,
+                )
+                raw_text = response.choices[0].message.content or ""
 
-            raw_text = response.choices[0].message.content or ""
             plan_dict = _extract_json(raw_text)
             plan = StepPlan.model_validate(plan_dict)
+            _remember_response(cache_key, raw_text)
 
             print(f"[agent] rid={request_id} replan validated: {len(plan.steps)} steps")
             return plan
 
         except AgentError:
             raise
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             last_error = AgentError(f"Invalid JSON from model on replan: {e}")
             print(f"[agent] rid={request_id} replan attempt={attempt + 1} JSON error: {e}")
         except Exception as e:
@@ -658,17 +955,17 @@ async def generate_next_step(
     """
     client = _get_client()
 
-    image_size_json = json.dumps({"w": image_size.w, "h": image_size.h})
-    prompt = _NEXT_STEP_PROMPT_TEMPLATE
-    prompt = prompt.replace("{{GOAL}}", goal)
-    prompt = prompt.replace("{{IMAGE_SIZE_JSON}}", image_size_json)
-    prompt = prompt.replace("{{COMPLETED_STEPS_JSON}}", completed_steps)
-    prompt = prompt.replace("{{TOTAL_STEPS}}", str(total_steps))
-    prompt = prompt.replace("{{LEARNING_PROFILE_TEXT}}", learning_profile or "default")
-    prompt = prompt.replace("{{APP_CONTEXT_JSON}}", app_context or "{}")
-    prompt = prompt.replace("{{ELEMENTS_CONTEXT}}", elements_context)
-
-    screenshot_b64 = base64.b64encode(screenshot_bytes).decode("utf-8")
+    image_size_json = orjson.dumps({"w": image_size.w, "h": image_size.h}).decode()
+    prompt = _fill_prompt(
+        _NEXT_STEP_PROMPT_TEMPLATE,
+        GOAL=goal,
+        IMAGE_SIZE_JSON=image_size_json,
+        COMPLETED_STEPS_JSON=completed_steps,
+        TOTAL_STEPS=str(total_steps),
+        LEARNING_PROFILE_TEXT=learning_profile or "default",
+        APP_CONTEXT_JSON=app_context or "{}",
+        ELEMENTS_CONTEXT=elements_context,
+    )
 
     model = os.getenv("OPENAI_NEXT_MODEL", os.getenv("OPENAI_MODEL", "gpt-4o"))
     messages = [
@@ -679,7 +976,7 @@ async def generate_next_step(
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/png;base64,{screenshot_b64}",
+                        "url": _image_data_url(screenshot_bytes),
                         "detail": "high",
                     },
                 },
@@ -721,12 +1018,12 @@ async def generate_som_plan(
     """
     client = _get_client()
 
-    image_size_json = json.dumps({"w": image_size.w, "h": image_size.h})
-    prompt = _SOM_PROMPT_TEMPLATE
-    prompt = prompt.replace("{{GOAL}}", goal)
-    prompt = prompt.replace("{{IMAGE_SIZE_JSON}}", image_size_json)
-
-    screenshot_b64 = base64.b64encode(screenshot_bytes).decode("utf-8")
+    image_size_json = orjson.dumps({"w": image_size.w, "h": image_size.h}).decode()
+    prompt = _fill_prompt(
+        _SOM_PROMPT_TEMPLATE,
+        GOAL=goal,
+        IMAGE_SIZE_JSON=image_size_json,
+    )
 
     model = os.getenv("OPENAI_MODEL", "gpt-4o")
     messages = [
@@ -737,7 +1034,7 @@ async def generate_som_plan(
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/png;base64,{screenshot_b64}",
+                        "url": _image_data_url(screenshot_bytes),
                         "detail": "high",
                     },
                 },
@@ -769,7 +1066,7 @@ async def generate_som_plan(
 
         except AgentError:
             raise
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             last_error = AgentError(f"Invalid JSON from SoM model: {e}")
             print(f"[agent] rid={request_id} som-plan attempt={attempt + 1} JSON parse error: {e}")
         except Exception as e:
@@ -796,11 +1093,11 @@ async def generate_refine(
     """
     client = _get_client()
 
-    prompt = _REFINE_PROMPT_TEMPLATE
-    prompt = prompt.replace("{{INSTRUCTION}}", instruction)
-    prompt = prompt.replace("{{TARGET_LABEL}}", target_label or "")
-
-    crop_b64 = base64.b64encode(crop_image_bytes).decode("utf-8")
+    prompt = _fill_prompt(
+        _REFINE_PROMPT_TEMPLATE,
+        INSTRUCTION=instruction,
+        TARGET_LABEL=target_label or "",
+    )
 
     model = os.getenv("OPENAI_MODEL", "gpt-4o")
     messages = [
@@ -811,7 +1108,7 @@ async def generate_refine(
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/png;base64,{crop_b64}",
+                        "url": _image_data_url(crop_image_bytes),
                         "detail": "high",
                     },
                 },
@@ -819,31 +1116,35 @@ async def generate_refine(
         }
     ]
 
+    params = {**_model_params(model, 500), "response_format": {"type": "json_object"}}
+    cache_key = _response_cache_key(model, messages, params)
     last_error: Exception | None = None
 
     for attempt in range(1 + MAX_RETRIES):
         try:
-            print(f"[agent] rid={request_id} refine attempt={attempt + 1} model={model}")
-
-            response = await client.chat.completions.create(
-                model=model,
-                messages=messages,
-                **_model_params(model, 500),
-                response_format={"type": "json_object"},
-            )
-
-            raw_text = response.choices[0].message.content or ""
-            print(f"[agent] rid={request_id} refine raw response length={len(raw_text)}")
+            raw_text = _response_cache.get(cache_key) if cache_key is not None else None
+            if raw_text is not None:
+                print(f"[agent] rid={request_id} refine response cache hit")
+            else:
+                print(f"[agent] rid={request_id} refine attempt={attempt + 1} model={model}")
+                response = await client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    **params,
+                )
+                raw_text = response.choices[0].message.content or ""
+                print(f"[agent] rid={request_id} refine raw response length={len(raw_text)}")
 
             bbox_dict = _extract_json(raw_text)
             bbox = RefineResponse.model_validate(bbox_dict)
+            _remember_response(cache_key, raw_text)
 
             print(f"[agent] rid={request_id} refine validated: ({bbox.x:.3f},{bbox.y:.3f},{bbox.w:.3f},{bbox.h:.3f}) conf={bbox.confidence}")
             return bbox
 
         except AgentError:
             raise
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             last_error = AgentError(f"Invalid JSON from refine model: {e}")
             print(f"[agent] rid={request_id} refine attempt={attempt + 1} JSON parse error: {e}")
         except Exception as e:
@@ -871,11 +1172,11 @@ async def generate_som_refine(
     """
     client = _get_client()
 
-    prompt = _SOM_REFINE_PROMPT_TEMPLATE
-    prompt = prompt.replace("{{INSTRUCTION}}", instruction)
-    prompt = prompt.replace("{{TARGET_LABEL}}", target_label or "")
-
-    crop_b64 = base64.b64encode(crop_image_bytes).decode("utf-8")
+    prompt = _fill_prompt(
+        _SOM_REFINE_PROMPT_TEMPLATE,
+        INSTRUCTION=instruction,
+        TARGET_LABEL=target_label or "",
+    )
 
     model = os.getenv("OPENAI_MODEL", "gpt-4o")
     messages = [
@@ -886,7 +1187,7 @@ async def generate_som_refine(
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/png;base64,{crop_b64}",
+                        "url": _image_data_url(crop_image_bytes),
                         "detail": "high",
                     },
                 },
@@ -926,7 +1227,7 @@ async def generate_som_refine(
 
         except AgentError:
             raise
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             last_error = AgentError(f"Invalid JSON from som-refine model: {e}")
             print(f"[agent] rid={request_id} som-refine attempt={attempt + 1} JSON parse error: {e}")
         except Exception as e:
@@ -958,16 +1259,16 @@ async def generate_omniparser_plan(
     """
     client = _get_client()
 
-    image_size_json = json.dumps({"w": image_size.w, "h": image_size.h})
-    prompt = _OMNI_PLAN_PROMPT_TEMPLATE
-    prompt = prompt.replace("{{GOAL}}", goal)
-    prompt = prompt.replace("{{IMAGE_SIZE_JSON}}", image_size_json)
-    prompt = prompt.replace("{{ELEMENTS_CONTEXT}}", elements_context)
-    prompt = prompt.replace("{{LEARNING_PROFILE_TEXT}}", learning_profile or "default")
-    prompt = prompt.replace("{{APP_CONTEXT_JSON}}", app_context or "{}")
-    prompt = prompt.replace("{{SESSION_SUMMARY}}", session_summary or "none")
-
-    screenshot_b64 = base64.b64encode(annotated_screenshot_bytes).decode("utf-8")
+    image_size_json = orjson.dumps({"w": image_size.w, "h": image_size.h}).decode()
+    prompt = _fill_prompt(
+        _OMNI_PLAN_PROMPT_TEMPLATE,
+        GOAL=goal,
+        IMAGE_SIZE_JSON=image_size_json,
+        ELEMENTS_CONTEXT=elements_context,
+        LEARNING_PROFILE_TEXT=learning_profile or "default",
+        APP_CONTEXT_JSON=app_context or "{}",
+        SESSION_SUMMARY=session_summary or "none",
+    )
 
     model = os.getenv("OPENAI_MODEL", "gpt-4o")
     messages = [
@@ -978,7 +1279,7 @@ async def generate_omniparser_plan(
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/png;base64,{screenshot_b64}",
+                        "url": _image_data_url(annotated_screenshot_bytes),
                         "detail": "high",
                     },
                 },
@@ -1017,24 +1318,24 @@ async def generate_omniparser_refine(
     """
     client = _get_client()
 
-    prompt = _OMNI_REFINE_PROMPT_TEMPLATE
-    prompt = prompt.replace("{{INSTRUCTION}}", instruction)
-    prompt = prompt.replace("{{TARGET_LABEL}}", target_label or "")
-    prompt = prompt.replace("{{ELEMENTS_CONTEXT}}", elements_context)
+    prompt = _fill_prompt(
+        _OMNI_REFINE_PROMPT_TEMPLATE,
+        INSTRUCTION=instruction,
+        TARGET_LABEL=target_label or "",
+        ELEMENTS_CONTEXT=elements_context,
+    )
 
     # Send the ANNOTATED crop (with numbered boxes) so the LLM can see
     # which element_id maps to which box, plus the raw crop so it can
     # read actual text labels on the UI underneath.
-    annotated_b64 = base64.b64encode(crop_image_bytes).decode("utf-8")
     content: list[dict] = [
         {"type": "text", "text": prompt},
-        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{annotated_b64}", "detail": "high"}},
+        {"type": "image_url", "image_url": {"url": _image_data_url(crop_image_bytes), "detail": "high"}},
     ]
     # Also send the raw (unannotated) crop so the LLM can read text beneath the boxes
     if raw_crop_bytes:
-        raw_b64 = base64.b64encode(raw_crop_bytes).decode("utf-8")
         content.append(
-            {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{raw_b64}", "detail": "high"}}
+            {"type": "image_url", "image_url": {"url": _image_data_url(raw_crop_bytes), "detail": "high"}}
         )
 
     # Use the main model for refine — accuracy matters here
@@ -1080,19 +1381,20 @@ async def generate_gemini_plan(
     """
     client = _get_client()
 
-    prompt = _GEMINI_PLAN_PROMPT_TEMPLATE
-    prompt = prompt.replace("{{GOAL}}", goal)
-    prompt = prompt.replace("{{ELEMENTS_CONTEXT}}", elements_context or "(no elements detected)")
-    prompt = prompt.replace("{{SEARCH_CONTEXT}}", search_context or "none")
-
-    # Send annotated screenshot (numbered boxes) + raw screenshot (readable text)
-    annotated_b64 = base64.b64encode(annotated_screenshot_bytes).decode("utf-8")
-    raw_b64 = base64.b64encode(raw_screenshot_bytes).decode("utf-8")
+    prompt = _fill_prompt(
+        _GEMINI_PLAN_PROMPT_TEMPLATE,
+        GOAL=goal,
+        ELEMENTS_CONTEXT=elements_context or "(no elements detected)",
+        SEARCH_CONTEXT=search_context or "none",
+    )
 
+    # Send annotated screenshot (numbered boxes) + raw screenshot (readable text).
+    # Images go first: Gemini prefers image-before-text, and a stable leading
+    # prefix lets its implicit context cache reuse the image tokens.
     content: list[dict] = [
+        {"type": "image_url", "image_url": {"url": _image_data_url(annotated_screenshot_bytes), "detail": "high"}},
+        {"type": "image_url", "image_url": {"url": _image_data_url(raw_screenshot_bytes), "detail": "high"}},
         {"type": "text", "text": prompt},
-        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{annotated_b64}", "detail": "high"}},
-        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{raw_b64}", "detail": "high"}},
     ]
 
     model = os.getenv("OPENAI_MODEL", "gemini-3-pro-preview")
@@ -1128,22 +1430,22 @@ async def generate_gemini_plan_stream(
     Streaming version of generate_gemini_plan.
     Yields partial results as they arrive:
       1. {"type": "instruction", "text": "..."} — as soon as instruction is found
-      2. {"type": "plan", "data": {...}} — full parsed JSON when complete
+      2. {"type": "step", "data": {...}} — each step object as soon as it closes
+      3. {"type": "plan", "data": {...}} — full parsed JSON when complete
     """
     client = _get_client()
 
-    prompt = _GEMINI_PLAN_PROMPT_TEMPLATE
-    prompt = prompt.replace("{{GOAL}}", goal)
-    prompt = prompt.replace("{{ELEMENTS_CONTEXT}}", elements_context or "(no elements detected)")
-    prompt = prompt.replace("{{SEARCH_CONTEXT}}", search_context or "none")
-
-    annotated_b64 = base64.b64encode(annotated_screenshot_bytes).decode("utf-8")
-    raw_b64 = base64.b64encode(raw_screenshot_bytes).decode("utf-8")
+    prompt = _fill_prompt(
+        _GEMINI_PLAN_PROMPT_TEMPLATE,
+        GOAL=goal,
+        ELEMENTS_CONTEXT=elements_context or "(no elements detected)",
+        SEARCH_CONTEXT=search_context or "none",
+    )
 
     content: list[dict] = [
+        {"type": "image_url", "image_url": {"url": _image_data_url(annotated_screenshot_bytes), "detail": "high"}},
+        {"type": "image_url", "image_url": {"url": _image_data_url(raw_screenshot_bytes), "detail": "high"}},
         {"type": "text", "text": prompt},
-        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{annotated_b64}", "detail": "high"}},
-        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{raw_b64}", "detail": "high"}},
     ]
 
     model = os.getenv("OPENAI_MODEL", "gemini-3-pro-preview")
@@ -1157,28 +1459,32 @@ async def generate_gemini_plan_stream(
 
     buffer = ""
     instruction_sent = False
+    scanner = _StepStreamScanner()
+
+    await _get_rate_limiter(model).acquire(_estimate_tokens([{"role": "user", "content": content}]))
+    stream = await client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": content}],
+        stream=True,
+        **params,
+        **extra_kwargs,
+    )
 
-    async with _llm_semaphore:
-        stream = await client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": content}],
-            stream=True,
-            **params,
-            **extra_kwargs,
-        )
+    async for chunk in stream:
+        delta = chunk.choices[0].delta if chunk.choices else None
+        if delta and delta.content:
+            buffer += delta.content
 
-        async for chunk in stream:
-            delta = chunk.choices[0].delta if chunk.choices else None
-            if delta and delta.content:
-                buffer += delta.content
+            # Try to extract instruction early from partial JSON
+            if not instruction_sent and '"instruction"' in buffer:
+                import re
+                m = re.search(r'"instruction"\s*:\s*"([^"]*)"', buffer)
+                if m:
+                    instruction_sent = True
+                    yield {"type": "instruction", "text": m.group(1)}
 
-                # Try to extract instruction early from partial JSON
-                if not instruction_sent and '"instruction"' in buffer:
-                    import re
-                    m = re.search(r'"instruction"\s*:\s*"([^"]*)"', buffer)
-                    if m:
-                        instruction_sent = True
-                        yield {"type": "instruction", "text": m.group(1)}
+            for step_data in scanner.feed(delta.content):
+                yield {"type": "step", "data": step_data}
 
     # Full response complete — parse and yield (with retry on bad JSON)
     print(f"[agent] rid={request_id} gemini-plan-stream complete, length={len(buffer)}")
@@ -1197,8 +1503,9 @@ async def generate_gemini_plan_stream(
                 request_id=request_id + "-retry",
                 search_context=search_context,
             )
-            # generate_gemini_plan returns a dict (already parsed)
-            yield {"type": "plan", "data": result}
+            # generate_gemini_plan returns a dict (already parsed). It is a fresh
+            # generation, so any steps streamed above don't belong to it.
+            yield {"type": "plan", "data": result, "retried": True}
         except Exception as retry_err:
             print(f"[agent] rid={request_id} gemini-plan-stream retry also failed: {retry_err}")
             raise parse_err
@@ -1226,21 +1533,20 @@ async def generate_gemini_next(
     """
     client = _get_client()
 
-    prompt = _GEMINI_NEXT_PROMPT_TEMPLATE
-    prompt = prompt.replace("{{GOAL}}", goal)
-    prompt = prompt.replace("{{SEARCH_CONTEXT}}", search_context or "none")
-    prompt = prompt.replace("{{NUM_COMPLETED}}", str(num_completed))
-    prompt = prompt.replace("{{TOTAL_STEPS}}", str(total_steps))
-    prompt = prompt.replace("{{COMPLETED_STEPS}}", completed_steps_summary or "none yet")
-    prompt = prompt.replace("{{ELEMENTS_CONTEXT}}", elements_context or "(no elements detected)")
-
-    annotated_b64 = base64.b64encode(annotated_screenshot_bytes).decode("utf-8")
-    raw_b64 = base64.b64encode(raw_screenshot_bytes).decode("utf-8")
+    prompt = _fill_prompt(
+        _GEMINI_NEXT_PROMPT_TEMPLATE,
+        GOAL=goal,
+        SEARCH_CONTEXT=search_context or "none",
+        NUM_COMPLETED=str(num_completed),
+        TOTAL_STEPS=str(total_steps),
+        COMPLETED_STEPS=completed_steps_summary or "none yet",
+        ELEMENTS_CONTEXT=elements_context or "(no elements detected)",
+    )
 
     content: list[dict] = [
         {"type": "text", "text": prompt},
-        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{annotated_b64}", "detail": "high"}},
-        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{raw_b64}", "detail": "high"}},
+        {"type": "image_url", "image_url": {"url": _image_data_url(annotated_screenshot_bytes), "detail": "high"}},
+        {"type": "image_url", "image_url": {"url": _image_data_url(raw_screenshot_bytes), "detail": "high"}},
     ]
 
     model = os.getenv("OPENAI_MODEL", "gemini-3-pro-preview")
@@ -1302,6 +1608,7 @@ def _wait_for_file_active(f):
 def upload_images_to_gemini(
     annotated_bytes: bytes,
     raw_bytes: bytes,
+    mime_type: str = "image/png",
 ) -> tuple:
     """
     Upload annotated + raw screenshots to Gemini File API.
@@ -1310,17 +1617,19 @@ def upload_images_to_gemini(
     """
     _ensure_genai()
 
+    suffix = ".jpg" if mime_type == "image/jpeg" else ".png"
+
     # Write to temp files (SDK needs file paths)
     paths = []
     try:
         for label, data in [("annotated", annotated_bytes), ("raw", raw_bytes)]:
-            tmp = tempfile.NamedTemporaryFile(suffix=".png", delete=False)
+            tmp = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
             tmp.write(data)
             tmp.close()
             paths.append(tmp.name)
 
-        annotated_file = genai.upload_file(paths[0], mime_type="image/png")
-        raw_file = genai.upload_file(paths[1], mime_type="image/png")
+        annotated_file = genai.upload_file(paths[0], mime_type=mime_type)
+        raw_file = genai.upload_file(paths[1], mime_type=mime_type)
 
         # Poll until processing completes (usually instant for images)
         annotated_file = _wait_for_file_active(annotated_file)
@@ -1353,47 +1662,54 @@ async def generate_gemini_plan_with_files_stream(
     """
     _ensure_genai()
 
-    prompt = _GEMINI_PLAN_PROMPT_TEMPLATE
-    prompt = prompt.replace("{{GOAL}}", goal)
-    prompt = prompt.replace("{{ELEMENTS_CONTEXT}}", elements_context or "(no elements detected)")
-    prompt = prompt.replace("{{SEARCH_CONTEXT}}", search_context or "none")
+    prompt = _fill_prompt(
+        _GEMINI_PLAN_PROMPT_TEMPLATE,
+        GOAL=goal,
+        ELEMENTS_CONTEXT=elements_context or "(no elements detected)",
+        SEARCH_CONTEXT=search_context or "none",
+    )
 
     model_name = os.getenv("OPENAI_MODEL", "gemini-3-flash-preview")
     model = genai.GenerativeModel(model_name)
 
     print(f"[agent] rid={request_id} gemini-plan-files-stream model={model_name}")
 
-    contents = [prompt, annotated_file, raw_file]
+    # Files before text so the shared image prefix can hit Gemini's implicit cache
+    contents = [annotated_file, raw_file, prompt]
 
     buffer = ""
     instruction_sent = False
+    scanner = _StepStreamScanner()
+
+    await _get_rate_limiter(model_name).acquire(_estimate_tokens([{"role": "user", "content": prompt}]))
+    response = await model.generate_content_async(
+        contents,
+        generation_config=genai.GenerationConfig(
+            response_mime_type="application/json",
+            max_output_tokens=4000,
+            temperature=0.1,
+        ),
+        stream=True,
+    )
 
-    async with _llm_semaphore:
-        response = await model.generate_content_async(
-            contents,
-            generation_config=genai.GenerationConfig(
-                response_mime_type="application/json",
-                max_output_tokens=4000,
-                temperature=0.1,
-            ),
-            stream=True,
-        )
+    async for chunk in response:
+        text = ""
+        try:
+            text = chunk.text or ""
+        except Exception:
+            pass
+        if text:
+            buffer += text
 
-        async for chunk in response:
-            text = ""
-            try:
-                text = chunk.text or ""
-            except Exception:
-                pass
-            if text:
-                buffer += text
+            # Try to extract instruction early from partial JSON
+            if not instruction_sent and '"instruction"' in buffer:
+                m = re.search(r'"instruction"\s*:\s*"([^"]*)"', buffer)
+                if m:
+                    instruction_sent = True
+                    yield {"type": "instruction", "text": m.group(1)}
 
-                # Try to extract instruction early from partial JSON
-                if not instruction_sent and '"instruction"' in buffer:
-                    m = re.search(r'"instruction"\s*:\s*"([^"]*)"', buffer)
-                    if m:
-                        instruction_sent = True
-                        yield {"type": "instruction", "text": m.group(1)}
+            for step_data in scanner.feed(text):
+                yield {"type": "step", "data": step_data}
 
     # Full response complete — parse and yield (with retry on bad JSON)
     print(f"[agent] rid={request_id} gemini-plan-files-stream complete, length={len(buffer)}")
@@ -1416,7 +1732,8 @@ async def generate_gemini_plan_with_files_stream(
             retry_text = retry_response.text or ""
             print(f"[agent] rid={request_id} retry response length={len(retry_text)}")
             result = _extract_json(retry_text)
-            yield {"type": "plan", "data": result}
+            # Fresh generation: any steps streamed above don't belong to it
+            yield {"type": "plan", "data": result, "retried": True}
         except Exception as retry_err:
             print(f"[agent] rid={request_id} retry also failed: {retry_err}")
             raise parse_err
@@ -1448,19 +1765,18 @@ async def verify_element(
     """
     client = _get_client()
 
-    prompt = _VERIFY_PROMPT_TEMPLATE
-    prompt = prompt.replace("{{INSTRUCTION}}", instruction)
-    prompt = prompt.replace("{{ELEMENT_ID}}", str(element_id))
-    prompt = prompt.replace("{{LABEL}}", label or "")
-    prompt = prompt.replace("{{ELEMENTS_CONTEXT}}", elements_context)
-
-    annotated_b64 = base64.b64encode(annotated_crop_bytes).decode("utf-8")
-    raw_b64 = base64.b64encode(raw_crop_bytes).decode("utf-8")
+    prompt = _fill_prompt(
+        _VERIFY_PROMPT_TEMPLATE,
+        INSTRUCTION=instruction,
+        ELEMENT_ID=str(element_id),
+        LABEL=label or "",
+        ELEMENTS_CONTEXT=elements_context,
+    )
 
     content: list[dict] = [
+        {"type": "image_url", "image_url": {"url": _image_data_url(annotated_crop_bytes), "detail": "high"}},
+        {"type": "image_url", "image_url": {"url": _image_data_url(raw_crop_bytes), "detail": "high"}},
         {"type": "text", "text": prompt},
-        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{annotated_b64}", "detail": "high"}},
-        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{raw_b64}", "detail": "high"}},
     ]
 
     model = os.getenv("OPENAI_MODEL", "gemini-2.5-flash")
@@ -1493,6 +1809,7 @@ async def generate_locate_steps(
     raw_screenshot_bytes: bytes,
     request_id: str = "",
     search_context: str = "",
+    raw_screenshot_url: str | None = None,
 ) -> dict:
     """
     Pass 1 of the two-pass zoom pipeline.
@@ -1503,18 +1820,19 @@ async def generate_locate_steps(
     can't read tiny overlapping box numbers. So we don't show boxes here.
 
     Returns dict with "steps" list, each containing box_2d, instruction, etc.
+    Pass raw_screenshot_url when the caller already built the data URL.
     """
     client = _get_client()
 
-    prompt = _LOCATE_PROMPT_TEMPLATE
-    prompt = prompt.replace("{{GOAL}}", goal)
-    prompt = prompt.replace("{{SEARCH_CONTEXT}}", search_context or "none")
-
-    raw_b64 = base64.b64encode(raw_screenshot_bytes).decode("utf-8")
+    prompt = _fill_prompt(
+        _LOCATE_PROMPT_TEMPLATE,
+        GOAL=goal,
+        SEARCH_CONTEXT=search_context or "none",
+    )
 
     content: list[dict] = [
         {"type": "text", "text": prompt},
-        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{raw_b64}", "detail": "high"}},
+        {"type": "image_url", "image_url": {"url": raw_screenshot_url or _image_data_url(raw_screenshot_bytes), "detail": "high"}},
     ]
 
     model = os.getenv("OPENAI_MODEL", "gemini-3-flash-preview")
@@ -1550,18 +1868,18 @@ async def generate_locate_next(
     """
     client = _get_client()
 
-    prompt = _LOCATE_NEXT_PROMPT_TEMPLATE
-    prompt = prompt.replace("{{GOAL}}", goal)
-    prompt = prompt.replace("{{SEARCH_CONTEXT}}", search_context or "none")
-    prompt = prompt.replace("{{NUM_COMPLETED}}", str(num_completed))
-    prompt = prompt.replace("{{TOTAL_STEPS}}", str(total_steps))
-    prompt = prompt.replace("{{COMPLETED_STEPS}}", completed_steps_summary or "none yet")
-
-    raw_b64 = base64.b64encode(raw_screenshot_bytes).decode("utf-8")
+    prompt = _fill_prompt(
+        _LOCATE_NEXT_PROMPT_TEMPLATE,
+        GOAL=goal,
+        SEARCH_CONTEXT=search_context or "none",
+        NUM_COMPLETED=str(num_completed),
+        TOTAL_STEPS=str(total_steps),
+        COMPLETED_STEPS=completed_steps_summary or "none yet",
+    )
 
     content: list[dict] = [
         {"type": "text", "text": prompt},
-        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{raw_b64}", "detail": "high"}},
+        {"type": "image_url", "image_url": {"url": _image_data_url(raw_screenshot_bytes), "detail": "high"}},
     ]
 
     model = os.getenv("OPENAI_MODEL", "gemini-3-flash-preview")
@@ -1607,18 +1925,17 @@ async def generate_identify_element(
     """
     client = _get_client()
 
-    prompt = _IDENTIFY_PROMPT_TEMPLATE
-    prompt = prompt.replace("{{INSTRUCTION}}", instruction)
-    prompt = prompt.replace("{{LABEL}}", label or "")
-    prompt = prompt.replace("{{ELEMENTS_CONTEXT}}", elements_context)
-
-    annotated_b64 = base64.b64encode(annotated_crop_bytes).decode("utf-8")
-    raw_b64 = base64.b64encode(raw_crop_bytes).decode("utf-8")
+    prompt = _fill_prompt(
+        _IDENTIFY_PROMPT_TEMPLATE,
+        INSTRUCTION=instruction,
+        LABEL=label or "",
+        ELEMENTS_CONTEXT=elements_context,
+    )
 
     content: list[dict] = [
         {"type": "text", "text": prompt},
-        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{annotated_b64}", "detail": "high"}},
-        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{raw_b64}", "detail": "high"}},
+        {"type": "image_url", "image_url": {"url": _image_data_url(annotated_crop_bytes), "detail": "high"}},
+        {"type": "image_url", "image_url": {"url": _image_data_url(raw_crop_bytes), "detail": "high"}},
     ]
 
     model = os.getenv("OPENAI_MODEL", "gemini-3-flash-preview")
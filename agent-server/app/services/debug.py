@@ -7,19 +7,62 @@
 #
 # Output directory: /tmp/og_debug/<request_id>/
 # Each file is prefixed with a step number for ordering.
+#
+# Disabled unless OVERLAYGUIDE_DEBUG=true. When enabled, files are written
+# on a worker thread so disk I/O never blocks the event loop.
 
-import json
+import asyncio
 import os
 import time
 from pathlib import Path
 
+import orjson
+
 DEBUG_ROOT = Path("/tmp/og_debug")
+_JSON_OPTIONS = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+
+
+# Read once at import (main.py loads .env before importing the routers), so the
+# per-write check on the request path is a constant lookup, not an env scan
+_DEBUG_ENABLED = os.getenv("OVERLAYGUIDE_DEBUG", "false").lower() == "true"
+
+
+def debug_enabled() -> bool:
+    """True when OVERLAYGUIDE_DEBUG=true; every debug write is a no-op otherwise."""
+    return _DEBUG_ENABLED
+
+
+def _write_path(path: Path, content: str | bytes):
+    try:
+        if isinstance(content, bytes):
+            path.write_bytes(content)
+        else:
+            path.write_text(content)
+    except Exception as e:
+        print(f"[debug] failed to save {path}: {e}")
+
+
+def _submit_write(path: Path, content: str | bytes):
+    """Write off the event loop when one is running (fire-and-forget), inline otherwise."""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _write_path(path, content)
+        return
+    loop.run_in_executor(None, _write_path, path, content)
+
+
+def write_debug_file(path: str | Path, content: str | bytes):
+    """Dump a single ad-hoc debug file (e.g. /tmp crops) if debug is enabled."""
+    if debug_enabled():
+        _submit_write(Path(path), content)
 
 
 class DebugSession:
     """
     Collects debug output for a single request.
     Creates a folder /tmp/og_debug/<request_id>/ and saves files into it.
+    Every method is a no-op unless OVERLAYGUIDE_DEBUG=true.
 
     Usage:
         dbg = DebugSession("my-request-id", goal="Open System Settings")
@@ -35,6 +78,9 @@ class DebugSession:
         self.endpoint = endpoint
         self._step = 0
         self._start_time = time.time()
+        self.enabled = debug_enabled()
+        if not self.enabled:
+            return
 
         # Create output directory
         self.dir = DEBUG_ROOT / request_id
@@ -54,25 +100,23 @@ class DebugSession:
 
     def _write_file(self, filename: str, content: str | bytes):
         """Write a file to the debug directory."""
-        path = self.dir / filename
-        try:
-            if isinstance(content, bytes):
-                path.write_bytes(content)
-            else:
-                path.write_text(content)
-        except Exception as e:
-            print(f"[debug] failed to save {path}: {e}")
+        _submit_write(self.dir / filename, content)
 
     def save_image(self, label: str, data: bytes, info: str = ""):
-        """Save an image (PNG) with a step number prefix."""
+        """Save an image (PNG or JPEG) with a step number prefix."""
+        if not self.enabled:
+            return
         prefix = self._next_prefix()
-        filename = f"{prefix}_{label}.png"
+        ext = "jpg" if data[:3] == b"\xff\xd8\xff" else "png"
+        filename = f"{prefix}_{label}.{ext}"
         self._write_file(filename, data)
         size_kb = len(data) / 1024
         print(f"[debug] rid={self.request_id} saved {filename} ({size_kb:.0f}KB) {info}")
 
     def save_text(self, label: str, text: str, info: str = ""):
         """Save a text file with a step number prefix."""
+        if not self.enabled:
+            return
         prefix = self._next_prefix()
         filename = f"{prefix}_{label}.txt"
         self._write_file(filename, text)
@@ -80,10 +124,12 @@ class DebugSession:
 
     def save_json(self, label: str, data: dict | list, info: str = ""):
         """Save a JSON file with a step number prefix."""
+        if not self.enabled:
+            return
         prefix = self._next_prefix()
         filename = f"{prefix}_{label}.json"
         try:
-            text = json.dumps(data, indent=2, ensure_ascii=False, default=str)
+            text = orjson.dumps(data, option=_JSON_OPTIONS, default=str)
         except Exception:
             text = str(data)
         self._write_file(filename, text)
@@ -94,6 +140,8 @@ class DebugSession:
         model: str = "", info: str = "",
     ):
         """Save both the prompt and raw LLM response as a single text file."""
+        if not self.enabled:
+            return
         prefix = self._next_prefix()
         filename = f"{prefix}_{label}.txt"
         elapsed = time.time() - self._start_time
@@ -118,6 +166,8 @@ class DebugSession:
         resolved_bbox: tuple, verification_result: dict | None = None,
     ):
         """Save the full resolution trace for a single step."""
+        if not self.enabled:
+            return
         prefix = self._next_prefix()
         filename = f"{prefix}_step_{step_id}_resolution.json"
         data = {
@@ -132,13 +182,15 @@ class DebugSession:
             "verification": verification_result,
         }
         try:
-            text = json.dumps(data, indent=2, ensure_ascii=False, default=str)
+            text = orjson.dumps(data, option=_JSON_OPTIONS, default=str)
         except Exception:
             text = str(data)
         self._write_file(filename, text)
 
     def finalize(self, plan_json: dict | None = None):
         """Write the final output and a summary."""
+        if not self.enabled:
+            return
         elapsed = time.time() - self._start_time
         summary = (
             f"request_id: {self.request_id}\n"
@@ -164,5 +216,5 @@ class DebugSession:
         self._write_file("99_summary.txt", summary)
         if plan_json:
             self._write_file("99_final_plan.json",
-                             json.dumps(plan_json, indent=2, ensure_ascii=False, default=str))
+                             orjson.dumps(plan_json, option=_JSON_OPTIONS, default=str))
         print(f"[debug] rid={self.request_id} session finalized -> {self.dir} ({self._step} files, {elapsed:.1f}s)")
@@ -11,7 +11,7 @@ from app.schemas.step_plan import (
     Step,
     StepPlan,
     TargetType,
-    TargetRect,
+    TargetRectBBox,
 )
 
 
@@ -32,7 +32,7 @@ def get_mock_next_step(
                 id=f"s{next_step_number}",
                 instruction=f"Click the next button to continue (step {next_step_number}).",
                 targets=[
-                    TargetRect(
+                    TargetRectBBox(
                         type=TargetType.bbox_norm,
                         x=0.45,
                         y=0.5,
@@ -61,7 +61,7 @@ def get_mock_plan(goal: str, image_size: ImageSize | None = None) -> StepPlan:
                 id="s1",
                 instruction="Click the menu bar item to begin.",
                 targets=[
-                    TargetRect(
+                    TargetRectBBox(
                         type=TargetType.bbox_norm,
                         x=0.02,
                         y=0.0,
@@ -77,7 +77,7 @@ def get_mock_plan(goal: str, image_size: ImageSize | None = None) -> StepPlan:
                 id="s2",
                 instruction="Select 'New...' from the dropdown menu.",
                 targets=[
-                    TargetRect(
+                    TargetRectBBox(
                         type=TargetType.bbox_norm,
                         x=0.02,
                         y=0.04,
@@ -93,7 +93,7 @@ def get_mock_plan(goal: str, image_size: ImageSize | None = None) -> StepPlan:
                 id="s3",
                 instruction="Type your information in the text field.",
                 targets=[
-                    TargetRect(
+                    TargetRectBBox(
                         type=TargetType.bbox_norm,
                         x=0.25,
                         y=0.3,
@@ -109,7 +109,7 @@ def get_mock_plan(goal: str, image_size: ImageSize | None = None) -> StepPlan:
                 id="s4",
                 instruction="Click 'Save' to confirm.",
                 targets=[
-                    TargetRect(
+                    TargetRectBBox(
                         type=TargetType.bbox_norm,
                         x=0.7,
                         y=0.85,
@@ -8,15 +8,21 @@
 # plus an annotated screenshot with numbered boxes.
 
 import base64
+import hashlib
 import io
 import os
 import re
 import tempfile
-from dataclasses import dataclass, field
+import threading
+from dataclasses import dataclass, field, replace
+from functools import lru_cache
 from pathlib import Path
 
+from cachetools import LRUCache
 from PIL import Image, ImageDraw, ImageFont
 
+from app.services.debug import write_debug_file
+
 
 @dataclass
 class OmniElement:
@@ -40,7 +46,7 @@ class OmniParserResult:
     """Result from OmniParser: detected elements + annotated image."""
 
     elements: list[OmniElement] = field(default_factory=list)
-    annotated_image_bytes: bytes = b""  # PNG with numbered boxes
+    annotated_image_bytes: bytes = b""  # JPEG with numbered boxes
 
 
 # ---------------------------------------------------------------------------
@@ -159,6 +165,76 @@ def _deduplicate_boxes(elements: list[tuple[float, list[float]]]) -> list[tuple[
     return kept
 
 
+def _elements_from_result(result) -> list[OmniElement]:
+    """
+    Turn one ultralytics result into OmniElements: sort by confidence,
+    drop true duplicates, and describe each box's location and size.
+    """
+    raw_elements: list[tuple[float, list[float]]] = []
+    if result is not None:
+        for box in result.boxes:
+            x1, y1, x2, y2 = box.xyxyn[0].tolist()
+            conf = box.conf[0].item()
+            raw_elements.append((conf, [x1, y1, x2, y2]))
+
+    raw_count = len(raw_elements)
+
+    # Sort by confidence (highest first)
+    raw_elements.sort(key=lambda x: x[0], reverse=True)
+
+    # Only remove true duplicates — keep everything else
+    raw_elements = _deduplicate_boxes(raw_elements)
+
+    print(f"[omniparser] {raw_count} raw -> {len(raw_elements)} elements (dedup only)")
+
+    elements: list[OmniElement] = []
+    for i, (conf, bbox) in enumerate(raw_elements):
+        cx = (bbox[0] + bbox[2]) / 2
+        cy = (bbox[1] + bbox[3]) / 2
+        w_norm = bbox[2] - bbox[0]
+        h_norm = bbox[3] - bbox[1]
+        loc = _describe_location(cx, cy)
+
+        area = w_norm * h_norm
+        if area < 0.001:
+            size = "tiny"
+        elif area < 0.005:
+            size = "small"
+        elif area < 0.02:
+            size = "medium"
+        else:
+            size = "large"
+
+        elements.append(OmniElement(
+            id=i,
+            type="icon",
+            content=f"{loc}, {size} element (conf={conf:.2f})",
+            bbox_xyxy=bbox,
+            interactivity=True,
+        ))
+
+    return elements
+
+
+# ---------------------------------------------------------------------------
+# Detection cache: identical screenshots (same goal retried, /start then
+# /plan on an unchanged screen) skip YOLO entirely.
+# ---------------------------------------------------------------------------
+_DETECT_CACHE_MAX = 128
+_detect_cache: LRUCache = LRUCache(maxsize=_DETECT_CACHE_MAX)
+_detect_cache_lock = threading.Lock()  # detection runs in worker threads
+
+
+def screenshot_digest(screenshot_bytes: bytes) -> bytes:
+    """Content hash used to key per-screenshot caches."""
+    return hashlib.blake2b(screenshot_bytes, digest_size=16).digest()
+
+
+def _copy_elements(elements: list[OmniElement]) -> list[OmniElement]:
+    """Fresh element objects — callers renumber ids in place."""
+    return [replace(e, bbox_xyxy=list(e.bbox_xyxy)) for e in elements]
+
+
 def detect_elements(
     screenshot_bytes: bytes,
     box_threshold: float = 0.05,
@@ -170,7 +246,27 @@ def detect_elements(
     Only removes true duplicates (IoU > 0.85). No confidence caps,
     no area filters, no element count limits — the two-pass zoom
     pipeline handles readability by showing boxes only on zoomed crops.
+    Results are memoized per screenshot content (LRU, _DETECT_CACHE_MAX).
     """
+    key = (screenshot_digest(screenshot_bytes), box_threshold, iou_threshold)
+    with _detect_cache_lock:
+        cached = _detect_cache.get(key)
+    if cached is not None:
+        print(f"[omniparser] cache hit ({len(cached)} elements)")
+        return _copy_elements(cached)
+
+    elements = _run_detect(screenshot_bytes, box_threshold, iou_threshold)
+    with _detect_cache_lock:
+        _detect_cache[key] = _copy_elements(elements)
+    return elements
+
+
+def _run_detect(
+    screenshot_bytes: bytes,
+    box_threshold: float,
+    iou_threshold: float,
+) -> list[OmniElement]:
+    """Uncached single-image YOLO pass behind detect_elements."""
     model = _get_yolo_model()
 
     with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
@@ -186,51 +282,7 @@ def detect_elements(
             verbose=False,
         )
 
-        raw_elements: list[tuple[float, list[float]]] = []
-        if results and len(results) > 0:
-            boxes = results[0].boxes
-            for box in boxes:
-                x1, y1, x2, y2 = box.xyxyn[0].tolist()
-                conf = box.conf[0].item()
-                raw_elements.append((conf, [x1, y1, x2, y2]))
-
-        raw_count = len(raw_elements)
-
-        # Sort by confidence (highest first)
-        raw_elements.sort(key=lambda x: x[0], reverse=True)
-
-        # Only remove true duplicates — keep everything else
-        raw_elements = _deduplicate_boxes(raw_elements)
-
-        print(f"[omniparser] {raw_count} raw -> {len(raw_elements)} elements (dedup only)")
-
-        elements: list[OmniElement] = []
-        for i, (conf, bbox) in enumerate(raw_elements):
-            cx = (bbox[0] + bbox[2]) / 2
-            cy = (bbox[1] + bbox[3]) / 2
-            w_norm = bbox[2] - bbox[0]
-            h_norm = bbox[3] - bbox[1]
-            loc = _describe_location(cx, cy)
-
-            area = w_norm * h_norm
-            if area < 0.001:
-                size = "tiny"
-            elif area < 0.005:
-                size = "small"
-            elif area < 0.02:
-                size = "medium"
-            else:
-                size = "large"
-
-            elements.append(OmniElement(
-                id=i,
-                type="icon",
-                content=f"{loc}, {size} element (conf={conf:.2f})",
-                bbox_xyxy=bbox,
-                interactivity=True,
-            ))
-
-        return elements
+        return _elements_from_result(results[0] if results else None)
 
     finally:
         try:
@@ -239,13 +291,85 @@ def detect_elements(
             pass
 
 
+def detect_elements_batch(
+    images: list[Image.Image],
+    box_threshold: float = 0.05,
+    iou_threshold: float = 0.1,
+) -> list[list[OmniElement]]:
+    """
+    Run the YOLO model once over several already-decoded RGB images (e.g.
+    every step's refine crop) instead of one predict call per image, with
+    no encode/decode round-trip. PIL images rather than ndarrays, because
+    ultralytics reads raw arrays as BGR. Returns one element list per
+    input, in input order, with the same filtering as detect_elements.
+    """
+    if not images:
+        return []
+
+    model = _get_yolo_model()
+    results = model.predict(
+        source=images,
+        conf=box_threshold,
+        iou=iou_threshold,
+        imgsz=1024,
+        verbose=False,
+    )
+    return [_elements_from_result(r) for r in results]
+
+
 # ---------------------------------------------------------------------------
 # Annotated screenshot drawing
 # ---------------------------------------------------------------------------
+_ANNOTATED_JPEG_QUALITY = 90
+# First match wins: macOS system fonts, then DejaVu (standard on Linux images)
+_LABEL_FONT_PATHS = (
+    "/System/Library/Fonts/Helvetica.ttc",
+    "/System/Library/Fonts/SFNSMono.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "DejaVuSans.ttf",  # resolved against the system font dirs by Pillow
+)
+
+
+@lru_cache(maxsize=1)
+def _label_font_face() -> ImageFont.FreeTypeFont | None:
+    """Locate and parse the label typeface once; None if no candidate loads."""
+    for path in _LABEL_FONT_PATHS:
+        try:
+            return ImageFont.truetype(path, 20)
+        except Exception:
+            continue
+    print("[omniparser] no TrueType label font found, using Pillow's default font")
+    return None
+
+
+@lru_cache(maxsize=64)
+def get_label_font(size: int) -> ImageFont.FreeTypeFont | ImageFont.ImageFont:
+    """
+    Label font at the given pixel size, loaded once per size and shared.
+    The typeface is resolved once (_label_font_face); each size is a cheap
+    font_variant of it. Falls back to Pillow's built-in default font.
+    """
+    face = _label_font_face()
+    if face is not None:
+        return face.font_variant(size=size)
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # Pillow < 10.1: fixed-size bitmap default only
+        return ImageFont.load_default()
+
+
+@lru_cache(maxsize=4096)
+def label_text_size(size: int, text: str) -> tuple[int, int]:
+    """
+    (width, height) of a label in get_label_font(size). Labels are small ids
+    drawn over and over, so the FreeType metrics are looked up once each.
+    """
+    left, top, right, bottom = get_label_font(size).getbbox(text)
+    return right - left, bottom - top
 
 
 def draw_numbered_boxes(
-    screenshot_bytes: bytes,
+    screenshot_bytes: bytes | Image.Image,
     elements: list[OmniElement],
 ) -> bytes:
     """
@@ -256,27 +380,27 @@ def draw_numbered_boxes(
       - Labels placed OUTSIDE the box (above) when possible, to keep
         the element's content visible
       - Consistent bright colors with dark text for maximum contrast
-    Returns annotated PNG bytes.
+    Accepts encoded bytes or an already-decoded PIL image.
+    Returns annotated JPEG bytes (several times smaller and faster to
+    encode than PNG for screenshots; every consumer accepts JPEG).
     """
-    img = Image.open(io.BytesIO(screenshot_bytes)).convert("RGBA")
+    # convert() always returns a new image, so a caller's image is never drawn on
+    if isinstance(screenshot_bytes, Image.Image):
+        img = screenshot_bytes.convert("RGB")
+    else:
+        img = Image.open(io.BytesIO(screenshot_bytes)).convert("RGB")
     actual_w, actual_h = img.size
 
-    # Transparent overlay for boxes + labels (so we don't paint over text)
-    overlay = Image.new("RGBA", img.size, (0, 0, 0, 0))
-    draw = ImageDraw.Draw(overlay)
+    # Draw straight onto the RGB image; the RGBA draw context alpha-blends the
+    # semi-transparent outlines/pills in place (no full-size overlay + composite)
+    draw = ImageDraw.Draw(img, "RGBA")
 
     # Larger font for readability — must survive Gemini's image downscaling.
     # On 3024px image: font=42px. On 1512px: font=24px.
     font_size = max(20, actual_w // 72)
     border_width = max(2, actual_w // 800)
 
-    try:
-        font = ImageFont.truetype("/System/Library/Fonts/Helvetica.ttc", font_size)
-    except Exception:
-        try:
-            font = ImageFont.truetype("/System/Library/Fonts/SFNSMono.ttf", font_size)
-        except Exception:
-            font = ImageFont.load_default()
+    font = get_label_font(font_size)
 
     # High-contrast color palette — bright backgrounds with dark text.
     # Using fewer, more distinct colors to reduce visual confusion.
@@ -307,9 +431,9 @@ def draw_numbered_boxes(
 
         # Draw number label as a pill/badge ABOVE the box
         label = str(elem.id)
-        label_bbox = draw.textbbox((0, 0), label, font=font)
-        lw = label_bbox[2] - label_bbox[0] + 14
-        lh = label_bbox[3] - label_bbox[1] + 8
+        tw, th = label_text_size(font_size, label)
+        lw = tw + 14
+        lh = th + 8
 
         # Try placing above the box; if too close to top edge, place inside
         if y1 - lh - 2 >= 0:
@@ -327,11 +451,8 @@ def draw_numbered_boxes(
         )
         draw.text((lx + 7, ly + 4), label, fill=(0, 0, 0, 255), font=font)
 
-    # Composite overlay onto the screenshot
-    result = Image.alpha_composite(img, overlay).convert("RGB")
-
     buf = io.BytesIO()
-    result.save(buf, format="PNG")
+    img.save(buf, format="JPEG", quality=_ANNOTATED_JPEG_QUALITY)
     return buf.getvalue()
 
 
@@ -383,11 +504,7 @@ async def parse_screenshot(
     annotated_bytes = draw_numbered_boxes(screenshot_bytes, elements)
 
     # Save annotated image for debugging
-    try:
-        with open("/tmp/overlayguide_omniparser_annotated.png", "wb") as f:
-            f.write(annotated_bytes)
-    except Exception:
-        pass
+    write_debug_file("/tmp/overlayguide_omniparser_annotated.jpg", annotated_bytes)
 
     return OmniParserResult(
         elements=elements,
@@ -485,6 +602,46 @@ async def _parse_via_gradio(
             pass
 
 
+# ---------------------------------------------------------------------------
+# Spatial grid: bucket elements into 10x10 cells so snapping only scans
+# the elements near the query instead of the whole list.
+# ---------------------------------------------------------------------------
+_GRID_CELLS = 10
+_GRID_EPS = 1e-9  # widen bboxes slightly so float error at cell edges can't drop a match
+
+
+def _grid_cell(v: float) -> int:
+    """Map a normalized coordinate to a grid cell index (clamped to the grid)."""
+    return min(_GRID_CELLS - 1, max(0, int(v * _GRID_CELLS)))
+
+
+@dataclass
+class ElementGrid:
+    """Elements bucketed by every grid cell their bbox overlaps."""
+
+    elements: list[OmniElement]
+    cells: list[list[list[int]]]  # cells[row][col] -> indices into elements
+
+    def candidates(self, x1: float, y1: float, x2: float, y2: float) -> list[OmniElement]:
+        """Elements overlapping any cell touched by [x1,y1,x2,y2], in original order."""
+        idx: set[int] = set()
+        for row in range(_grid_cell(y1), _grid_cell(y2) + 1):
+            for col in range(_grid_cell(x1), _grid_cell(x2) + 1):
+                idx.update(self.cells[row][col])
+        return [self.elements[i] for i in sorted(idx)]
+
+
+def build_element_grid(elements: list[OmniElement]) -> ElementGrid:
+    """Build the spatial grid once per element list (e.g. once per request)."""
+    cells: list[list[list[int]]] = [[[] for _ in range(_GRID_CELLS)] for _ in range(_GRID_CELLS)]
+    for i, e in enumerate(elements):
+        x1, y1, x2, y2 = e.bbox_xyxy
+        for row in range(_grid_cell(y1 - _GRID_EPS), _grid_cell(y2 + _GRID_EPS) + 1):
+            for col in range(_grid_cell(x1 - _GRID_EPS), _grid_cell(x2 + _GRID_EPS) + 1):
+                cells[row][col].append(i)
+    return ElementGrid(elements=elements, cells=cells)
+
+
 # ---------------------------------------------------------------------------
 # Snap Gemini box_2d to nearest YOLO element
 # ---------------------------------------------------------------------------
@@ -494,6 +651,7 @@ def snap_to_nearest_element(
     gemini_x: float, gemini_y: float, gemini_w: float, gemini_h: float,
     elements: list[OmniElement],
     max_distance: float = 0.06,
+    grid: ElementGrid | None = None,
 ) -> tuple[float, float, float, float, int | None]:
     """
     Find the YOLO element that best matches Gemini's bounding box.
@@ -505,6 +663,10 @@ def snap_to_nearest_element(
       2. IoU: best for overlapping boxes of similar size.
       3. Center-distance: fallback for near-miss cases.
 
+    If a prebuilt grid (see build_element_grid) is passed, each pass only
+    scans the elements in the cells it can possibly match; results are
+    identical to the full scan.
+
     Returns (x, y, w, h, matched_element_id).
     """
     if not elements:
@@ -526,8 +688,9 @@ def snap_to_nearest_element(
     # --- Pass 1: Center containment (best for dropdown menus) ---
     # Find all YOLO elements whose bbox contains the CENTER of Gemini's box.
     # Among matches, pick the smallest (most specific) element that isn't too tiny.
+    containment_pool = grid.candidates(gcx, gcy, gcx, gcy) if grid is not None else elements
     containment_matches = []
-    for elem in elements:
+    for elem in containment_pool:
         ex, ey, ew, eh = elem.bbox_xywh
         e_area = ew * eh
         if (ex <= gcx <= ex + ew) and (ey <= gcy <= ey + eh):
@@ -547,7 +710,8 @@ def snap_to_nearest_element(
     best_iou_elem = None
     best_iou = 0.0
 
-    for elem in elements:
+    iou_pool = grid.candidates(gx1, gy1, gx2, gy2) if grid is not None else elements
+    for elem in iou_pool:
         ex, ey, ew, eh = elem.bbox_xywh
         e_area = ew * eh
         # Skip elements much smaller than Gemini's box
@@ -578,7 +742,14 @@ def snap_to_nearest_element(
     best_elem = None
     best_dist = float("inf")
 
-    for elem in elements:
+    # An element center within max_distance lies in a cell the square around
+    # (gcx, gcy) touches — only valid while max_distance is under one cell.
+    if grid is not None and max_distance < 1.0 / _GRID_CELLS:
+        dist_pool = grid.candidates(gcx - max_distance, gcy - max_distance,
+                                    gcx + max_distance, gcy + max_distance)
+    else:
+        dist_pool = elements
+    for elem in dist_pool:
         ex, ey, ew, eh = elem.bbox_xywh
         e_area = ew * eh
         if e_area / gemini_area < min_area_ratio:
@@ -607,7 +778,34 @@ def snap_to_nearest_element(
 # ---------------------------------------------------------------------------
 
 
+_CONTEXT_CACHE_MAX = 128
+_context_cache: LRUCache = LRUCache(maxsize=_CONTEXT_CACHE_MAX)
+_context_cache_lock = threading.Lock()
+
+
 def format_elements_context(elements: list[OmniElement], max_elements: int = 120) -> str:
+    """
+    Memoized wrapper around _build_elements_context.
+    Keyed on element content (not list identity — callers renumber ids in place),
+    so the same detection result is only formatted once across /start,
+    /plan-stream and repeated crops.
+    """
+    if not elements:
+        return "(no elements detected)"
+
+    key = (max_elements, tuple((e.id, e.content, tuple(e.bbox_xyxy)) for e in elements))
+    with _context_cache_lock:
+        cached = _context_cache.get(key)
+    if cached is not None:
+        return cached
+
+    text = _build_elements_context(elements, max_elements)
+    with _context_cache_lock:
+        _context_cache[key] = text
+    return text
+
+
+def _build_elements_context(elements: list[OmniElement], max_elements: int) -> str:
     """
     Format OmniParser elements into a text context string for the LLM prompt.
     Each element is listed with its ID, type, content, bbox, and nearby neighbors.
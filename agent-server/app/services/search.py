@@ -10,7 +10,6 @@
 # instead of a standalone OpenAI client.
 
 import asyncio
-import base64
 import html
 import json
 import os
@@ -19,14 +18,30 @@ import urllib.parse
 from typing import Optional
 
 import httpx
+from cachetools import TTLCache
 
-from app.services.agent import _get_client, _model_params, _supports_json_mode
+from app.services.agent import _get_client, _image_data_url, _model_params, _supports_json_mode
 
 # ---------------------------------------------------------------------------
 # In-memory store: goal -> search context string
-# Persists across requests within the same server process.
+# Persists across requests within the same server process. Bounded and
+# expiring so goals from long-finished sessions don't accumulate; the TTL
+# comfortably outlasts a single guided session of /next calls.
 # ---------------------------------------------------------------------------
-_search_store: dict[str, str] = {}
+_SEARCH_STORE_TTL = 3600  # seconds
+_SEARCH_STORE_MAX = 256
+_search_store: TTLCache = TTLCache(maxsize=_SEARCH_STORE_MAX, ttl=_SEARCH_STORE_TTL)
+
+# ---------------------------------------------------------------------------
+# Result cache: (goal, app_context) -> search context string
+# Search results for the same goal in the same app are effectively
+# deterministic, so repeat /plan calls skip query generation + SERP calls.
+# The screenshot is deliberately not part of the key. Keys are plain
+# (goal, app_context) tuples so clear_search_context can evict by goal.
+# ---------------------------------------------------------------------------
+_SEARCH_CACHE_TTL = 600  # seconds
+_SEARCH_CACHE_MAX = 256
+_search_cache: TTLCache = TTLCache(maxsize=_SEARCH_CACHE_MAX, ttl=_SEARCH_CACHE_TTL)
 
 # ---------------------------------------------------------------------------
 # Constants
@@ -59,6 +74,7 @@ async def _generate_search_queries(
     goal: str,
     screenshot_bytes: bytes | None = None,
     app_context: str | None = None,
+    screenshot_url: str | None = None,
 ) -> list[str]:
     """
     Use the project's LLM client to produce 1-3 concise Google search
@@ -86,12 +102,11 @@ async def _generate_search_queries(
 
     # Optionally include screenshot at low detail for context
     if screenshot_bytes:
-        screenshot_b64 = base64.b64encode(screenshot_bytes).decode("utf-8")
         content.append(
             {
                 "type": "image_url",
                 "image_url": {
-                    "url": f"data:image/png;base64,{screenshot_b64}",
+                    "url": screenshot_url or _image_data_url(screenshot_bytes),
                     "detail": "low",
                 },
             }
@@ -253,6 +268,7 @@ async def search_for_goal(
     screenshot_bytes: bytes | None = None,
     app_context: str | None = None,
     request_id: str = "",
+    screenshot_url: str | None = None,
 ) -> str:
     """
     Search the web for information related to the user's goal.
@@ -263,16 +279,26 @@ async def search_for_goal(
     3. Extracts clean text from the HTML results.
     4. Stores the context in-memory keyed by goal for reuse in /next calls.
     5. Returns the search context string.
+
+    Results are cached per (goal, app_context) for _SEARCH_CACHE_TTL seconds.
+    screenshot_url, if given, is the caller's prebuilt data URL for screenshot_bytes.
     """
     # Skip if no Bright Data key
     if not os.getenv("BRIGHTDATA_API_KEY"):
         print(f"[search] rid={request_id} no BRIGHTDATA_API_KEY, skipping")
         return ""
 
+    cache_key = (goal, app_context or "")
+    cached = _search_cache.get(cache_key)
+    if cached:
+        _search_store[goal] = cached
+        print(f"[search] rid={request_id} cache hit for goal={goal!r} ({len(cached)} chars)")
+        return cached
+
     print(f"[search] rid={request_id} starting search for goal={goal!r}")
 
     # Step 1: Generate queries
-    queries = await _generate_search_queries(goal, screenshot_bytes, app_context)
+    queries = await _generate_search_queries(goal, screenshot_bytes, app_context, screenshot_url)
     print(f"[search] rid={request_id} queries: {queries}")
 
     # Step 2: Execute searches in parallel
@@ -289,8 +315,10 @@ async def search_for_goal(
     # Step 3: Extract and clean
     context = _extract_search_context(valid_results)
 
-    # Step 4: Store for later /next calls
+    # Step 4: Store for later /next calls and repeat searches
     _search_store[goal] = context
+    if context:
+        _search_cache[cache_key] = context
     print(
         f"[search] rid={request_id} stored {len(context)} chars "
         f"of search context ({len(valid_results)} queries succeeded)"
@@ -305,8 +333,11 @@ def get_stored_search_context(goal: str) -> str:
 
 
 def clear_search_context(goal: str | None = None):
-    """Clear stored search context (for a specific goal or all)."""
+    """Clear stored search context and cached results (for a specific goal or all)."""
     if goal:
         _search_store.pop(goal, None)
+        for key in [k for k in _search_cache if k[0] == goal]:
+            _search_cache.pop(key, None)
     else:
         _search_store.clear()
+        _search_cache.clear()
@@ -35,6 +35,7 @@ from app.routers.plan import (
     _generate_markers_and_image,
     _som_plan_to_step_plan,
     _crop_and_draw_sub_markers,
+    _decode_rgb,
     _REFINED_BBOX_PAD,
     SOM_COLUMNS,
     SOM_ROWS,
@@ -59,6 +60,11 @@ def take_screenshot() -> tuple[bytes, int, int]:
     return png, img.width, img.height
 
 
+def image_ext(data: bytes) -> str:
+    """File extension for encoded image bytes (SoM images are JPEG unless SOM_IMAGE_FORMAT=png)."""
+    return "jpg" if data[:2] == b"\xff\xd8" else "png"
+
+
 def draw_bbox_on_image(img_bytes: bytes, targets: list[dict], label: str) -> bytes:
     """Draw colored bboxes on an image. targets = [{x,y,w,h,label,color}]."""
     img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
@@ -116,7 +122,7 @@ async def run_test(goal: str):
     t0 = time.time()
     markers, marked_bytes = _generate_markers_and_image(png_bytes)
     print(f"  {len(markers)} markers, {len(marked_bytes):,} bytes ({time.time()-t0:.1f}s)")
-    (OUT_DIR / "02_coarse_markers.png").write_bytes(marked_bytes)
+    (OUT_DIR / f"02_coarse_markers.{image_ext(marked_bytes)}").write_bytes(marked_bytes)
 
     # 3. Pass 1: model picks coarse markers
     print(f"\n[3/5] Pass 1: asking {model} to pick coarse markers...")
@@ -151,13 +157,14 @@ async def run_test(goal: str):
     # 4. Pass 2: refine each target
     print(f"\n[4/5] Pass 2: refining with {REFINE_SUB_COLS}x{REFINE_SUB_ROWS} sub-grid...")
     refined_targets_all = []
+    screenshot_img = _decode_rgb(png_bytes)  # decoded once, shared by every crop
     
     for si, step in enumerate(coarse_plan.steps):
         for ti, target in enumerate(step.targets):
             t0 = time.time()
-            crop_rect, marked_crop, sub_markers = _crop_and_draw_sub_markers(png_bytes, target)
+            crop_rect, marked_crop, sub_markers = _crop_and_draw_sub_markers(screenshot_img, target)
             
-            crop_name = f"04_crop_s{si}_t{ti}.png"
+            crop_name = f"04_crop_s{si}_t{ti}.{image_ext(marked_crop)}"
             (OUT_DIR / crop_name).write_bytes(marked_crop)
             
             img_crop = Image.open(io.BytesIO(marked_crop))
@@ -225,9 +232,9 @@ async def run_test(goal: str):
     print(f"\n{'='*70}")
     print(f"  Done! Open /tmp/som_test/ in Finder to inspect:")
     print(f"    01_raw_screenshot.png   - original screenshot")
-    print(f"    02_coarse_markers.png   - screenshot with coarse grid")
+    print(f"    02_coarse_markers.jpg   - screenshot with coarse grid")
     print(f"    03_coarse_targets.png   - red boxes from pass 1")
-    print(f"    04_crop_s*_t*.png       - zoomed crops with sub-grid")
+    print(f"    04_crop_s*_t*.jpg       - zoomed crops with sub-grid")
     print(f"    05_final_result.png     - red (coarse) + green (refined)")
     print(f"    05_refined_only.png     - just the green refined boxes")
     print(f"{'='*70}")